@@ -0,0 +1,264 @@
+from compiler_analyzer import CompilerAnalyzer
+from compiler_cfg import ControlFlowGraph
+from compiler_ir import CompactCode, Liveness, ScalarLiveness
+from compiler_optimizer import CompilerOptimizer
+from code_generator import CompilerCodeGenerator
+from compiler import compile_source
+from compiler_lexer import CompilerLexer
+from compiler_parser import CompilerParser
+from peephole import PeepholeOptimizer
+from vm import CompiledMachine, VirtualMachine
+import copy
+import random
+import sys
+import time
+import tracemalloc
+
+
+def synthetic_target_code(size, seed=0):
+    rand = random.Random(seed)
+    labels = ['label' + str(n) for n in range((size + 9) // 10)]
+    code = []
+    for n in range(size):
+        if n % 10 == 0:
+            code.append(labels[n // 10])
+        if n % 5 == 4:
+            target = rand.randrange(len(labels))
+            direction = 'F' if target * 10 > n else 'B'
+            code.append(f'JZERO a {labels[target]}:{direction}')
+        else:
+            code.append('INC a')
+    return code
+
+
+def bench_link_jumps(sizes=(1000, 10000, 100000, 1000000)):
+    print(f"{'instructions':>12} {'seconds':>10} {'us/instr':>10}")
+    for size in sizes:
+        generator = CompilerCodeGenerator(CompilerAnalyzer([('WRITE', ('NUM', 0))]))
+        generator.target_code = synthetic_target_code(size)
+        start = time.perf_counter()
+        generator.link_jumps()
+        elapsed = time.perf_counter() - start
+        print(f'{size:>12} {elapsed:>10.3f} {elapsed / size * 1e6:>10.3f}')
+
+
+SIEVE = '''
+DECLARE
+    n, j, t(2:1000), k
+BEGIN
+    READ n;
+    k := 0;
+    FOR r FROM 1 TO n DO
+        FOR i FROM 2 TO 1000 DO
+            t(i) := i;
+        ENDFOR
+        FOR i FROM 2 TO 1000 DO
+            IF t(i) != 0 THEN
+                j := i + i;
+                WHILE j <= 1000 DO
+                    t(j) := 0;
+                    j := j + i;
+                ENDWHILE
+                k := k + 1;
+            ENDIF
+        ENDFOR
+    ENDFOR
+    WRITE k;
+END
+'''
+
+
+def bench_vm(rounds=(1, 10, 50)):
+    target_code = compile_source(SIEVE)
+    # same: outputs, cost, I/O cost and steps equal to those of the reference machine
+    print(f"{'engine':>12} {'rounds':>8} {'steps':>10} {'seconds':>10} {'Msteps/s':>10} {'same':>5}")
+    for n in rounds:
+        reference = None
+        for name, engine in (('reference', VirtualMachine), ('compiled', CompiledMachine)):
+            machine = engine(target_code, [n], seed=n)
+            start = time.perf_counter()
+            machine.run()
+            elapsed = time.perf_counter() - start
+            result = machine.outputs, machine.cost, machine.io_cost, machine.steps
+            reference = reference or result
+            print(f'{name:>12} {n:>8} {machine.steps:>10} {elapsed:>10.3f} '
+                  f'{machine.steps / elapsed / 1e6:>10.3f} {"yes" if result == reference else "no":>5}')
+
+
+def unlinked_target_code(source, size):  # code of source before linking, repeated with fresh labels
+    analyzer = CompilerAnalyzer(CompilerParser().parse(CompilerLexer().tokenize(source)))
+    generator = CompilerCodeGenerator(analyzer)
+    generator.linked = False
+    code = [line for line in generator.generate() if line != 'HALT']
+    labels = analyzer.label_counter
+    tiled = []
+    for n in range(0, (size + len(code) - 1) // len(code)):
+        for line in code:
+            if line[0].isupper() and not line.startswith('J'):
+                tiled.append(line)
+            else:
+                s = line.split(' ')
+                name, _, direction = s[-1].partition(':')
+                s[-1] = f'label{int(name[5:]) + n * labels}' + (':' + direction if direction else '')
+                tiled.append(' '.join(s))
+    return tiled[:size - 1] + ['HALT']
+
+
+ARITHMETIC = '''
+DECLARE
+    a, b, c
+BEGIN
+    READ a;
+    READ b;
+    c := a {} b;
+    WRITE c;
+END
+'''
+
+
+def bench_operator(operator, expected, samples=2000, seed=0):
+    # checks the results on the reference machine for operands of random lengths up to the number
+    # of bits in the first column and prints their average cost, reading and writing left out
+    target_code = compile_source(ARITHMETIC.format(operator))
+    rand = random.Random(seed)
+    print(f"{'operator':>8} {'bits':>6} {'samples':>8} {'wrong':>6} {'avg cost':>10}")
+    for bits in (8, 16, 32, 62):
+        wrong = 0
+        cost = 0
+        for _ in range(samples):
+            a = rand.getrandbits(rand.randint(1, bits))
+            b = rand.getrandbits(rand.randint(1, bits))
+            machine = VirtualMachine(target_code, [a, b], seed=rand.getrandbits(31))
+            machine.run()
+            wrong += machine.outputs != [expected(a, b)]
+            cost += machine.cost - machine.io_cost
+        print(f'{operator:>8} {bits:>6} {samples:>8} {wrong:>6} {cost / samples:>10.1f}')
+
+
+def bench_mult():
+    bench_operator('*', lambda a, b: a * b)
+
+
+def bench_div():
+    bench_operator('/', lambda a, b: a // b if b else 0)
+    bench_operator('%', lambda a, b: a % b if b else 0)
+
+
+def bench_peephole(sizes=(1000, 10000, 100000, 1000000)):
+    print(f"{'instructions':>12} {'after':>10} {'passes':>8} {'seconds':>10} {'us/instr':>10}")
+    for size in sizes:
+        code = unlinked_target_code(SIEVE, size)
+        peephole = PeepholeOptimizer()
+        start = time.perf_counter()
+        optimized = peephole.optimize(code)
+        elapsed = time.perf_counter() - start
+        print(f'{size:>12} {len(optimized):>10} {peephole.passes:>8} {elapsed:>10.3f} {elapsed / size * 1e6:>10.3f}')
+    for name, hits in peephole.hits.items():
+        print(f'{name:>20} {hits:>10}')
+
+
+def synthetic_program(statements, seed=0):  # source of a random program with about that many statements
+    def name(prefix, n):  # identifiers are made of letters only
+        return prefix + ''.join(chr(ord('a') + int(digit)) for digit in str(n))
+    rand = random.Random(seed)
+    names = ['a', 'b', 'c', 'd', 'e', 'f']
+    lines = [f'READ {x};' for x in names]
+    counters = []
+    ends = []
+    for _ in range(statements):
+        kind = rand.random()
+        x, y, z = (rand.choice(names) for _ in range(3))
+        if kind < 0.5 or len(ends) > 3:
+            value = rand.choice([z, str(rand.randint(0, 1000)), f't({rand.randint(0, 9)})'])
+            lines.append(f'{x} := {y} {rand.choice("+-*/%")} {value};')
+        elif kind < 0.6:
+            lines.append(f't({rand.randint(0, 9)}) := {y};')
+        elif kind < 0.7:
+            lines.append(f'WRITE {x};')
+        elif kind < 0.8:
+            lines.append(f'IF {x} {rand.choice(["=", "!=", "<", ">", "<=", ">="])} {y} THEN')
+            ends.append(['ENDIF'])
+        elif kind < 0.9:
+            w = name('w', len(counters))
+            counters.append(w)
+            lines += [f'{w} := {rand.randint(1, 5)};', f'WHILE {w} > 0 DO']
+            ends.append([f'{w} := {w} - 1;', 'ENDWHILE'])
+        else:
+            lines.append(f'FOR {name("i", len(ends))} FROM {x} DOWNTO {rand.randint(0, 5)} DO')
+            ends.append(['ENDFOR'])
+        if ends and rand.random() < 0.25 and not lines[-1].endswith(('THEN', 'DO')):
+            lines += ends.pop()
+    for end in reversed(ends):
+        lines += [f'WRITE a;'] + end
+    declarations = ', '.join(names + ['t(0:9)'] + counters)
+    return f'DECLARE\n    {declarations}\nBEGIN\n    ' + '\n    '.join(lines) + '\nEND\n'
+
+
+def bench_ir(sizes=(250, 500, 1000)):
+    # memory of the intermediate code of a random program as lists and as CompactCode, time and peak
+    # memory of the liveness analyses built on it and time of the whole optimizer
+    print(f"{'statements':>10} {'lines':>7} {'list KB':>9} {'compact KB':>10} {'analysis s':>10} "
+          f"{'analysis KB':>11} {'optimizer s':>11}")
+    for size in sizes:
+        source = synthetic_program(size)
+        analyzer = CompilerAnalyzer(CompilerParser().parse(CompilerLexer().tokenize(source)))
+        code = analyzer.intermediate_code
+        tracemalloc.start()
+        copied = copy.deepcopy(code)
+        list_size = tracemalloc.get_traced_memory()[0]
+        del copied
+        tracemalloc.stop()
+        tracemalloc.start()
+        compact = CompactCode(code, analyzer.symbol_table)
+        compact_size = tracemalloc.get_traced_memory()[0]
+        del compact
+        tracemalloc.stop()
+        start = time.perf_counter()
+        Liveness(code)
+        ScalarLiveness(code, analyzer.symbol_table)
+        analysis_time = time.perf_counter() - start
+        tracemalloc.start()
+        Liveness(code)
+        ScalarLiveness(code, analyzer.symbol_table)
+        analysis_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        CompilerOptimizer(analyzer).optimize()
+        optimizer_time = time.perf_counter() - start
+        print(f'{size:>10} {len(code):>7} {list_size / 1024:>9.0f} {compact_size / 1024:>10.0f} '
+              f'{analysis_time:>10.3f} {analysis_peak / 1024:>11.0f} {optimizer_time:>11.2f}')
+
+
+def bench_cfg(sizes=(1000, 4000, 16000)):
+    print(f"{'statements':>10} {'lines':>7} {'blocks':>7} {'loops':>6} {'depth':>6} {'seconds':>8} {'us/line':>8}")
+    for size in sizes:
+        analyzer = CompilerAnalyzer(CompilerParser().parse(CompilerLexer().tokenize(synthetic_program(size))))
+        code = analyzer.intermediate_code
+        start = time.perf_counter()
+        cfg = ControlFlowGraph(code)
+        elapsed = time.perf_counter() - start
+        depth = max((loop.depth for loop in cfg.loops), default=0)
+        print(f'{size:>10} {len(code):>7} {len(cfg.blocks):>7} {len(cfg.loops):>6} {depth:>6} '
+              f'{elapsed:>8.3f} {elapsed / len(code) * 1e6:>8.2f}')
+
+
+benchmarks = {
+    'link_jumps': bench_link_jumps,
+    'vm': bench_vm,
+    'peephole': bench_peephole,
+    'mult': bench_mult,
+    'div': bench_div,
+    'ir': bench_ir,
+    'cfg': bench_cfg,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] in benchmarks:
+        benchmarks[sys.argv[1]]()
+    elif len(sys.argv) == 1:
+        for name, bench in benchmarks.items():
+            print(f'--- {name}')
+            bench()
+    else:
+        print(f"Usage: python3 benchmark.py [{'|'.join(benchmarks)}]")
@@ -1,3 +1,35 @@
+import contextlib
+
+from compiler_ir import MIRRORED, Liveness, defines, derivation, simplify_condition
+from peephole import PeepholeOptimizer
+from register_allocator import RegisterAllocator
+
+
+def is_power_of_two(c):
+    return isinstance(c, int) and c > 0 and c & (c - 1) == 0
+
+
+def shift_add_chain(c):
+    # digits of c from the most significant one, either binary or non-adjacent form (-1, 0, 1),
+    # whichever is cheaper as a chain of SHL (1) and ADD/SUB (5) steps
+    naf = []
+    n = c
+    while n:
+        if n & 1:
+            digit = 2 - (n & 3)
+            n -= digit
+        else:
+            digit = 0
+        naf.append(digit)
+        n >>= 1
+    binary = [int(b) for b in bin(c)[2:]]
+    naf.reverse()
+
+    def cost(digits):
+        return len(digits) - 1 + 5 * (sum(1 for d in digits if d) - 1)
+    return min(binary, naf, key=cost)
+
+
 class Register:
     def __init__(self, name):
         self.name = name
@@ -6,13 +38,19 @@ class Register:
 
 
 class CompilerCodeGenerator:
-    def __init__(self, analyzer):
+    def __init__(self, analyzer, allocate_registers=True):
         self.analyzer = analyzer
         self.target_code = []
         self.line_nr = 0
         self.linked = True
+        self.allocate_registers = allocate_registers
+        self.peephole = PeepholeOptimizer()
+        self.profile = None  # CompileProfile timing the parts of generate()
         regs = 'abcdef'
         self.register_desc = {r: Register(r) for r in regs}
+        self.pinned = {}  # memory cell address -> register holding it for the whole loop
+        self.alias = {}  # temporary loaded from a pinned cell -> register of that cell
+        self.handed = {}  # register given out for the current line -> whether the caller may modify it
         self.symbol_table = analyzer.symbol_table
         self.intermediate_code = analyzer.intermediate_code
         self.switch = {
@@ -31,57 +69,72 @@ class CompilerCodeGenerator:
             '/': self.generate_div,
             '%': self.generate_mod,
         }
-        self.operator = {
-            '>': self.greater,
-            '<': self.lesser,
-            '>=': self.geq,
-            '<=': self.leq,
-        }
 
     def generate(self):
-        for line in self.intermediate_code:
-            self.line_nr += 1
-            if line[0] in self.switch:
-                self.switch[line[0]](line)
-            else:
-                self.target_code.append(line[0])
-                self.clear_reg_tags()
+        allocator = None
+        if self.allocate_registers:
+            with self.phase('allocate registers'):
+                allocator = RegisterAllocator(self.intermediate_code, self.symbol_table, self.measure_pressure())
+        with self.phase('translate'):
+            self.liveness = Liveness(self.intermediate_code)
+            self.pressure = [0] * len(self.intermediate_code)
+            for i, line in enumerate(self.intermediate_code):
+                self.line_nr += 1
+                if allocator:
+                    self.unpin(allocator.exit_before.get(i, ()), i - 1)
+                    self.pin(allocator.entry.get(i, ()))
+                self.handed = {}
+                if line[0] in self.switch:
+                    self.switch[line[0]](line)
+                else:
+                    self.target_code.append(line[0])
+                    self.clear_reg_tags()
+                if allocator:
+                    self.unpin(allocator.exit_after.get(i, ()), i)
         if self.linked:
-            self.link_jumps()
+            if self.peephole:
+                with self.phase('peephole'):
+                    self.target_code = self.peephole.optimize(self.target_code)
+            with self.phase('link jumps'):
+                self.link_jumps()
         return self.target_code
 
+    def phase(self, name):
+        return self.profile.phase(name) if self.profile else contextlib.nullcontext()
+
+    def measure_pressure(self):  # dry run without pinned registers, peak of allocated registers per line
+        dry_run = CompilerCodeGenerator(self.analyzer, allocate_registers=False)
+        dry_run.linked = False
+        dry_run.generate()
+        return dry_run.pressure
+
     def link_jumps(self):
-        labels = []
-        for i in range(len(self.target_code)):
-            line = self.target_code[i]
+        # first pass drops labels and remembers the index of the instruction each one points to,
+        # second pass turns every label reference into a relative offset
+        positions = {}
+        code = []
+        for line in self.target_code:
+            if line[0].isupper():
+                code.append(line)
+            else:
+                positions[line] = len(code)
+        for i, line in enumerate(code):
             if line[0] == 'J':
                 s = line.split(' ')
-                lab = s[-1]
-                label = lab.split(':')[0]
-                labels.append(label)
-                direction = lab.split(':')[1]
-                j = i
-                counter = 0
-                if direction == 'F':
-                    while self.target_code[j] != label:
-                        if self.target_code[j][0].isupper():
-                            counter += 1
-                        j += 1
-                else:
-                    while self.target_code[j] != label:
-                        if self.target_code[j][0].isupper():
-                            counter -= 1
-                        j -= 1
-                    counter += 1
-                self.target_code[i] = self.target_code[i].replace(lab, str(counter))
-        self.target_code = [x for x in self.target_code if x not in labels]
+                label = s[-1].split(':')[0]
+                s[-1] = str(positions[label] - i)
+                code[i] = ' '.join(s)
+        self.target_code = code
 
     def generate_assign(self, line):
         var = line[2]
         value = line[1]
         var_addr = self.analyzer.symbol_table[var]['address']
-        reg_addr = self.get_register_for(var_addr)
-        reg_val = self.get_register_for(value)
+        if var_addr in self.pinned:
+            self.assign_pinned(self.pinned[var_addr], value)
+            return
+        reg_addr = self.get_source_register(var_addr)
+        reg_val = self.get_source_register(value)
         self.store(reg_val, reg_addr)
         self.free_reg(reg_addr)
         self.free_reg(reg_val)
@@ -89,7 +142,10 @@ class CompilerCodeGenerator:
     def generate_load(self, line):
         addr = line[1]
         target = line[2]
-        r1 = self.get_register_for(addr)
+        if addr in self.pinned:
+            self.alias[target] = self.pinned[addr]
+            return
+        r1 = self.get_source_register(addr)
         r2 = self.get_register_for()
         self.load(r2, r1)
         self.set_stored(r2, target)
@@ -99,71 +155,113 @@ class CompilerCodeGenerator:
     def generate_store(self, line):
         addr = line[2]
         var = line[1]
-        r1 = self.get_register_for(addr)
-        r2 = self.get_register_for(var)
+        if addr in self.pinned:
+            self.assign_pinned(self.pinned[addr], var)
+            return
+        r1 = self.get_source_register(addr)
+        r2 = self.get_source_register(var)
         self.store(r2, r1)
         self.free_reg(r2)
         self.free_reg(r1)
 
     def generate_read(self, line):
         addr = line[1]
-        reg = self.get_register_for(addr)
+        if addr in self.pinned:
+            self.release_aliases(self.pinned[addr])
+            reg = self.get_register_for(addr)
+            self.read(reg)
+            self.load(self.pinned[addr], reg)
+            self.free_reg(reg)
+            return
+        reg = self.get_source_register(addr)
         self.read(reg)
         self.free_reg(reg)
 
     def generate_write(self, line):
         addr = line[1]
-        reg = self.get_register_for(addr)
-        s = self.register_desc[reg].stored
+        if addr in self.pinned:
+            reg = self.get_register_for(addr)
+            self.store(self.pinned[addr], reg)
+        else:
+            reg = self.get_source_register(addr)
         self.write(reg)
         self.free_reg(reg)
 
     def generate_if(self, line):
-        condition = line[1]
+        # every condition jumps with a single JZERO where the saturating SUB allows it: a <= b is
+        # a - b = 0, a < b is a + 1 - b = 0 and a = b is a + 1 - b = 1; only != and a nonzero test
+        # jump over a JUMP
+        condition = simplify_condition(*line[1])
         label = line[3]
-        op = condition[1]
-        arg1 = condition[0]
-        arg2 = condition[2]
-        if op == '=':
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
-            reg3 = self.get_register_for()
-            r = self.inequal(reg1, reg2, reg3)
-            self.jzero(r, label + ":F")
-            self.free_reg(reg3)
-        elif op == '!=':
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
-            reg3 = self.get_register_for()
-            r = self.equal(reg1, reg2, reg3)
+        if condition is True:
+            self.jump(label)
+            return
+        if condition is False:
+            return
+        arg1, op, arg2 = condition
+        if op == '>' or op == '>=':
+            arg1, op, arg2 = arg2, MIRRORED[op], arg1
+        if arg2 == 0:  # = or !=
+            reg1 = self.get_source_register(arg1)
+            if op == '=':
+                self.jzero(reg1, label)
+            else:
+                self.jump_unless_zero(reg1, label)
+            self.free_reg(reg1)
+            return
+        if op == '<' and isinstance(arg2, int):
+            op = '<='
+            arg2 -= 1
+        elif op == '<' and isinstance(arg1, int):
+            op = '<='
+            arg1 += 1
+        elif (op == '=' or op == '!=') and isinstance(arg1, int):
+            arg1, arg2 = arg2, arg1
+        reg1 = self.get_register_for(arg1)
+        reg2 = self.get_source_register(arg2)
+        if op != '<=':
+            self.inc(reg1)
+        self.sub(reg1, reg2)
+        self.clear_tags(reg1)
+        if op == '<=' or op == '<':
+            self.jzero(reg1, label)
+        elif op == '=':
             l = self.analyzer.get_label()
-            self.jzero(r, l + ":F")
-            self.jump(label + ":F")
+            self.jzero(reg1, l + ':F')
+            self.dec(reg1)
+            self.jzero(reg1, label)
             self.target_code.append(l)
-            self.free_reg(reg3)
         else:
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
-            r = self.operator[op](reg1, reg2)
-            l = self.analyzer.get_label()
-            self.jzero(r, l + ":F")
-            self.jump(label + ":F")
-            self.target_code.append(l)
+            self.jzero(reg1, label)
+            self.dec(reg1)
+            self.jump_unless_zero(reg1, label)
         self.free_reg(reg1)
         self.free_reg(reg2)
 
+    def jump_unless_zero(self, reg, label):
+        l = self.analyzer.get_label()
+        self.jzero(reg, l + ':F')
+        self.jump(label)
+        self.target_code.append(l)
+
     def generate_jump(self, line):
         self.jump(line[1])
         self.clear_reg_tags()
 
     def generate_inc(self, line):
-        reg = self.get_register_for(line[1])
+        reg = self.get_register_to_update(line[1], line[1])
         self.inc(reg)
+        if reg in self.register_desc:
+            self.alias.pop(line[1], None)
+            self.set_stored(reg, line[1])
         self.free_reg(reg)
 
     def generate_dec(self, line):
-        reg = self.get_register_for(line[1])
+        reg = self.get_register_to_update(line[1], line[1])
         self.dec(reg)
+        if reg in self.register_desc:
+            self.alias.pop(line[1], None)
+            self.set_stored(reg, line[1])
         self.free_reg(reg)
 
     def generate_sub(self, line):
@@ -171,12 +269,13 @@ class CompilerCodeGenerator:
         arg2 = line[2]
         target = line[3]
         if arg2 == 1:
-            reg1 = self.get_register_for(arg1)
+            reg1 = self.get_register_to_update(arg1, target)
             self.dec(reg1)
             self.set_stored(reg1, target)
+            self.free_reg(reg1)
         else:
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
+            reg1 = self.get_register_to_update(arg1, target)
+            reg2 = self.get_source_register(arg2)
             self.sub(reg1, reg2)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
@@ -187,16 +286,21 @@ class CompilerCodeGenerator:
         arg2 = line[2]
         target = line[3]
         if arg1 == 1:
-            reg1 = self.get_register_for(arg2)
+            reg1 = self.get_register_to_update(arg2, target)
             self.inc(reg1)
             self.set_stored(reg1, target)
+            self.free_reg(reg1)
         elif arg2 == 1:
-            reg1 = self.get_register_for(arg1)
+            reg1 = self.get_register_to_update(arg1, target)
             self.inc(reg1)
             self.set_stored(reg1, target)
+            self.free_reg(reg1)
         else:
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
+            if arg2 in self.alias and self.alias.get(arg1) != self.alias[arg2] \
+                    and self.is_written_back(self.alias[arg2], arg2, target):
+                arg1, arg2 = arg2, arg1
+            reg1 = self.get_register_to_update(arg1, target)
+            reg2 = self.get_source_register(arg2)
             self.add(reg1, reg2)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
@@ -206,24 +310,10 @@ class CompilerCodeGenerator:
         arg1 = line[1]
         arg2 = line[2]
         target = line[3]
-        if arg1 == 2:
-            reg1 = self.get_register_for(arg2)
-            self.shl(reg1)
-            self.set_stored(reg1, target)
-            self.free_reg(reg1)
-        elif arg2 == 2:
-            reg1 = self.get_register_for(arg1)
-            self.shl(reg1)
-            self.set_stored(reg1, target)
-            self.free_reg(reg1)
-        elif arg2 == 1:
-            reg1 = self.get_register_for(arg1)
-            self.set_stored(reg1, target)
-            self.free_reg(reg1)
-        elif arg1 == 1:
-            reg1 = self.get_register_for(arg2)
-            self.set_stored(reg1, target)
-            self.free_reg(reg1)
+        if isinstance(arg1, int) and not isinstance(arg2, int):
+            arg1, arg2 = arg2, arg1
+        if isinstance(arg2, int) and not isinstance(arg1, int):
+            self.mult_by_constant(arg1, arg2, target)
         else:
             reg1 = self.get_register_for(arg1)
             reg2 = self.get_register_for(arg2)
@@ -238,186 +328,320 @@ class CompilerCodeGenerator:
         arg1 = line[1]
         arg2 = line[2]
         target = line[3]
-        if arg2 == 2:
-            reg1 = self.get_register_for(arg1)
-            self.shr(reg1)
+        if is_power_of_two(arg2):
+            reg1 = self.get_register_to_update(arg1, target)
+            for _ in range(arg2.bit_length() - 1):
+                self.shr(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
         elif arg2 == 0:
-            reg1 = self.get_register_for(arg1)
+            reg1 = self.get_register_to_update(arg1, target)
             self.clear_reg(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
         elif arg1 == 0:
-            reg1 = self.get_register_for(arg2)
+            reg1 = self.get_register_to_update(arg2, target)
             self.clear_reg(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
-        elif arg2 == 1:
-            reg1 = self.get_register_for(arg1)
-            self.set_stored(reg1, target)
-            self.free_reg(reg1)
         else:
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
-            reg3 = self.get_register_for()
-            reg4 = self.get_register_for()
-            reg5 = self.get_register_for()
-            q, r = self.div(reg1, reg2, reg3, reg4, reg5)
-            self.set_stored(q, target)
-            self.clear_tags(r)
-            self.free_reg(reg1)
-            self.free_reg(reg2)
-            self.free_reg(reg3)
-            self.free_reg(reg4)
-            self.free_reg(reg5)
+            self.division(arg1, arg2, target, remainder=False)
 
     def generate_mod(self, line):
         arg1 = line[1]
         arg2 = line[2]
         target = line[3]
         if arg2 == 0:
-            reg1 = self.get_register_for(arg1)
+            reg1 = self.get_register_to_update(arg1, target)
             self.clear_reg(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
         elif arg1 == 0:
-            reg1 = self.get_register_for(arg2)
+            reg1 = self.get_register_to_update(arg2, target)
             self.clear_reg(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
         elif arg2 == 1:
-            reg1 = self.get_register_for(arg1)
+            reg1 = self.get_register_to_update(arg1, target)
             self.clear_reg(reg1)
             self.set_stored(reg1, target)
             self.free_reg(reg1)
-        else:
-            reg1 = self.get_register_for(arg1)
-            reg2 = self.get_register_for(arg2)
-            reg3 = self.get_register_for()
-            reg4 = self.get_register_for()
-            reg5 = self.get_register_for()
-            q, r = self.div(reg1, reg2, reg3, reg4, reg5)
-            self.set_stored(r, target)
-            self.clear_tags(q)
+        elif arg2 == 2:
+            reg1 = self.get_source_register(arg1)
+            reg2 = self.get_register_for()
+            self.odd(reg2, reg1)
+            self.set_stored(reg2, target)
             self.free_reg(reg1)
             self.free_reg(reg2)
-            self.free_reg(reg3)
-            self.free_reg(reg4)
-            self.free_reg(reg5)
+        elif is_power_of_two(arg2):
+            reg1 = self.get_register_to_update(arg1, target)
+            reg2 = self.get_register_for()
+            self.mov(reg2, reg1)
+            for _ in range(arg2.bit_length() - 1):
+                self.shr(reg2)
+            for _ in range(arg2.bit_length() - 1):
+                self.shl(reg2)
+            self.sub(reg1, reg2)
+            self.clear_tags(reg2)
+            self.set_stored(reg1, target)
+            self.free_reg(reg1)
+            self.free_reg(reg2)
+        else:
+            self.division(arg1, arg2, target, remainder=True)
+
+    def mult_by_constant(self, arg, c, target):
+        if c == 0 or is_power_of_two(c):
+            reg = self.get_register_to_update(arg, target)
+            if c == 0:
+                self.clear_reg(reg)
+            for _ in range(c.bit_length() - 1):
+                self.shl(reg)
+            self.set_stored(reg, target)
+            self.free_reg(reg)
+            return
+        source = self.get_source_register(arg)
+        reg = self.get_register_for()
+        self.clear_reg(reg)
+        self.add(reg, source)
+        for digit in shift_add_chain(c)[1:]:
+            self.shl(reg)
+            if digit == 1:
+                self.add(reg, source)
+            elif digit == -1:
+                self.sub(reg, source)
+        self.set_stored(reg, target)
+        self.free_reg(source)
+        self.free_reg(reg)
+
+    def division(self, arg, divisor, target, remainder):
+        rem = self.get_register_for(arg)
+        other = self.get_register_for()
+        b = self.get_register_for(divisor)
+        bit = self.get_register_for(1)
+        q = None if remainder else self.get_register_for()
+        r = self.div(rem, other, b, bit, q, check_zero=not isinstance(divisor, int))
+        self.set_stored(r, target)
+        for reg in (rem, other, b, bit, q):
+            if reg is not None:
+                if reg != r:
+                    self.clear_tags(reg)
+                self.free_reg(reg)
 
     # ------------------------------------------ registers allocation -----------------------------------------------
 
     def set_stored(self, reg, arg):
-        self.register_desc[reg].stored = arg
+        if reg in self.register_desc:
+            self.register_desc[reg].stored = arg
+        elif arg is not None:
+            self.alias[arg] = reg
 
     def empty(self, reg):
-        self.register_desc[reg].allocated = False
+        if reg in self.register_desc:
+            self.register_desc[reg].allocated = False
 
     def clear_tags(self, reg):
-        self.register_desc[reg].stored = None
+        if reg in self.register_desc:
+            self.register_desc[reg].stored = None
 
     def free_reg(self, reg):
+        if reg not in self.register_desc:
+            return
         arg = self.register_desc[reg].stored
         if isinstance(arg, int):
             self.empty(reg)
             return
-        for line in self.intermediate_code[self.line_nr:]:
-            if self.is_in(line, arg):
-                return
-            if line[0] == 'J':
-                break
+        if arg and self.liveness.is_live_after(arg, self.line_nr - 1):
+            return
         self.clear_tags(reg)
         self.empty(reg)
 
-    def is_in(self, arr, target):
-        if not target:
-            return False
-        if target in arr:
-            return True
-        else:
-            for e in arr:
-                if isinstance(e, list):
-                    return self.is_in(e, target)
-        return False
-
-    def get_register_for(self, arg=None):
+    def get_register_for(self, arg=None):  # the register may be modified by the caller
+        if arg in self.alias:
+            return self.copy_pinned(arg)
         for r in self.register_desc:
             if self.register_desc[r].stored == arg and arg:
+                if r in self.handed or self.is_needed_later(arg):
+                    return self.copy_of(r)
                 self.register_desc[r].allocated = True
+                self.handed[r] = True
+                self.measure()
                 return r
+        free = [r for r in self.register_desc if not self.register_desc[r].allocated]
+        if not free:
+            print(f'ERROR FOR {arg}')
+            return None
+        r = free[0]
+        if isinstance(arg, int):  # cheapest to build, keeping other cached constants if possible
+            r = min(free, key=lambda f: (self.value_source(f, arg)[0],
+                                         isinstance(self.register_desc[f].stored, int)))
+        self.register_desc[r].allocated = True
+        self.handed[r] = True
+        self.measure()
+        if isinstance(arg, int):
+            self.set_value(r, arg)
+        else:
+            self.register_desc[r].stored = arg
+        return r
+
+    def get_source_register(self, arg):  # the register is only read by the caller
+        if arg in self.alias:
+            return self.alias[arg]
         for r in self.register_desc:
-            if not self.register_desc[r].allocated:
+            if self.register_desc[r].stored == arg and arg:
+                if self.handed.get(r):
+                    return self.copy_of(r)
                 self.register_desc[r].allocated = True
-                self.register_desc[r].stored = arg
-                if isinstance(arg, int):
-                    self.set_value(r, arg)
+                self.handed[r] = False
+                self.measure()
                 return r
-        print(f'ERROR FOR {arg}')
+        r = self.get_register_for(arg)
+        self.handed[r] = False
+        return r
+
+    def is_needed_later(self, arg):  # a temporary keeping its value past the current line
+        i = self.line_nr - 1
+        return defines(self.intermediate_code[i]) != arg and self.liveness.is_live_after(arg, i)
+
+    def copy_of(self, source):
+        desc = self.register_desc.get(source)
+        allocated = desc.allocated if desc else False
+        if desc:
+            desc.allocated = True  # not to be chosen for its own copy
+        reg = self.get_register_for()
+        if desc:
+            desc.allocated = allocated
+        self.mov(reg, source)
+        self.clear_tags(reg)
+        return reg
+
+    def get_register_to_update(self, arg, target):
+        reg = self.alias.get(arg)
+        if reg and self.is_written_back(reg, arg, target):
+            return reg
+        return self.get_register_for(arg)
+
+    def is_written_back(self, reg, arg, target):  # next line stores target into the cell pinned to reg
+        if self.line_nr >= len(self.intermediate_code):
+            return False
+        line = self.intermediate_code[self.line_nr]
+        if line[0] == 'ASSIGN':
+            address = self.symbol_table[line[2]]['address']
+        elif line[0] == 'STORE':
+            address = line[2]
+        else:
+            return False
+        if line[1] != target or self.pinned.get(address) != reg:
+            return False
+        for t, r in self.alias.items():
+            if r == reg and t != target and self.liveness.is_live_after(t, self.line_nr - 1):
+                return False
+        return arg == target or not self.liveness.is_live_after(arg, self.line_nr - 1)
+
+    def copy_pinned(self, arg):
+        reg = self.get_register_for()
+        self.clear_reg(reg)
+        self.add(reg, self.alias[arg])
+        self.set_stored(reg, arg)
+        return reg
+
+    def assign_pinned(self, reg, value):
+        if self.alias.get(value) == reg:
+            return
+        self.release_aliases(reg)
+        if isinstance(value, int):
+            self.set_value(reg, value)
+        else:
+            source = self.get_source_register(value)
+            self.clear_reg(reg)
+            self.add(reg, source)
+            self.free_reg(source)
+
+    def release_aliases(self, reg):  # reg is about to change, copy out temporaries that still need it
+        for t in [t for t, r in self.alias.items() if r == reg]:
+            if self.liveness.is_live_after(t, self.line_nr - 1):
+                self.copy_pinned(t)
+            del self.alias[t]
+
+    def pin(self, pins):
+        for address, reg, load in pins:
+            del self.register_desc[reg]
+            self.pinned[address] = reg
+            if load:
+                self.set_value(reg, address)
+                self.load(reg, reg)
+
+    def unpin(self, pins, line):  # temporaries live after the line and loaded from a cell stay in its register
+        for address, reg, store in pins:
+            del self.pinned[address]
+            kept = []
+            for t in [t for t, r in self.alias.items() if r == reg]:
+                if self.liveness.is_live_after(t, line):
+                    kept.append(t)
+                del self.alias[t]
+            if store:
+                reg_addr = self.get_register_for(address)
+                self.store(reg, reg_addr)
+                self.free_reg(reg_addr)
+            self.register_desc[reg] = Register(reg)
+            for t in kept[1:]:
+                self.set_stored(self.copy_of(reg), t)
+            if kept:
+                self.register_desc[reg].stored = kept[0]
+                self.register_desc[reg].allocated = True
+        if pins:
+            self.register_desc = {r: self.register_desc[r] for r in 'abcdef' if r in self.register_desc}
+
+    def measure(self):
+        allocated = sum(1 for r in self.register_desc.values() if r.allocated)
+        if allocated > self.pressure[self.line_nr - 1]:
+            self.pressure[self.line_nr - 1] = allocated
 
     def clear_reg_tags(self):
         for r in self.register_desc:
             self.register_desc[r].stored = None
             self.register_desc[r].allocated = False
+        self.alias.clear()
+
+    def value_source(self, reg, val):
+        # cheapest start for building val in reg: its own cached constant, a copy of another
+        # register's constant or zero; returns (cost, source register or None, start value, k)
+        cost, k = derivation(0, val)
+        best = (cost + 1, None, 0, k)
+        for r, desc in self.register_desc.items():
+            if isinstance(desc.stored, int):
+                cost, k = derivation(desc.stored, val)
+                if r != reg:
+                    cost += 6
+                if cost < best[0]:
+                    best = (cost, r, desc.stored, k)
+        return best
 
     def set_value(self, reg, val):
-        self.register_desc[reg].stored = val
-        self.clear_reg(reg)
-        if val == 0:
-            return
-        binary = str(bin(val))
-        binary = binary[3:]
-        self.inc(reg)
-        for b in binary:
-            if b == '1':
-                self.shl(reg)
+        cost, source, start, k = self.value_source(reg, val)
+        if reg in self.register_desc:
+            self.register_desc[reg].stored = val
+        if source != reg:
+            self.clear_reg(reg)
+            if source is not None:
+                self.add(reg, source)
+        step = val >> k
+        for _ in range(start, step):
+            self.inc(reg)
+        for _ in range(step, start):
+            self.dec(reg)
+        for bit in range(k - 1, -1, -1):
+            self.shl(reg)
+            if val >> bit & 1:
                 self.inc(reg)
-            else:
-                self.shl(reg)
 
     # ------------------------------------------ target translation -----------------------------------------------
 
     def mov(self, target, source):
         self.clear_reg(target)
-        self.set_stored(target, self.register_desc[source].stored)
+        if source in self.register_desc:
+            self.set_stored(target, self.register_desc[source].stored)
         self.target_code.append(f'ADD {target} {source}')
 
-    def equal(self, reg1, reg2, reg3):
-        self.mov(reg3, reg1)
-        self.sub(reg1, reg2)
-        self.sub(reg2, reg3)
-        self.add(reg1, reg2)
-        self.clear_tags(reg1)
-        self.clear_tags(reg2)
-        return reg1  # !=0 means false
-
-    def inequal(self, reg1, reg2, reg3):
-        self.mov(reg3, reg1)
-        self.sub(reg1, reg2)
-        self.sub(reg2, reg3)
-        self.add(reg1, reg2)
-        self.clear_tags(reg1)
-        self.clear_tags(reg2)
-        return reg1
-
-    def greater(self, reg1, reg2):
-        self.sub(reg1, reg2)
-        self.clear_tags(reg1)
-        return reg1
-
-    def lesser(self, reg1, reg2):
-        self.sub(reg2, reg1)
-        self.clear_tags(reg2)
-        return reg2
-
-    def geq(self, reg1, reg2):
-        self.inc(reg1)
-        return self.greater(reg1, reg2)
-
-    def leq(self, reg1, reg2):
-        self.inc(reg2)
-        return self.lesser(reg1, reg2)
-
     def load(self, reg1, reg2):
         self.target_code.append(f'LOAD {reg1} {reg2}')
 
@@ -452,75 +676,105 @@ class CompilerCodeGenerator:
         self.target_code.append(f'ADD {reg1} {reg2}')
 
     def mult(self, reg1, reg2, reg3):
+        # shift and add over the bits of the smaller operand, found with one subtraction
         l1 = self.analyzer.get_label()
         l2 = self.analyzer.get_label()
-        l3 = self.analyzer.get_label()
-        l4 = self.analyzer.get_label()
+        self.mov(reg3, reg2)
+        self.sub(reg3, reg1)
+        self.jzero(reg3, l1+':F')
         self.clear_reg(reg3)
+        self.mult_loop(reg2, reg1, reg3, l2)
         self.target_code.append(l1)
-        self.jzero(reg2, l4+':F')
-        self.jodd(reg2, l3+':F')
+        self.mult_loop(reg1, reg2, reg3, l2)
         self.target_code.append(l2)
-        self.shr(reg2)
-        self.shl(reg1)
-        self.jump(l1+':B')
-        self.target_code.append(l3)
-        self.add(reg3, reg1)
-        self.jump(l2+':B')
-        self.target_code.append(l4)
         self.clear_tags(reg1)
         self.clear_tags(reg2)
+        self.clear_tags(reg3)
         return reg3
 
-    def div(self, a, b, c, res, a_cln):
+    def mult_loop(self, a, b, res, end):
+        # res = a * b for res 0 on entry; a zero bit of b costs 3.5 on average (two of them are
+        # tested per jump back), a one bit 9, as the next bit is tested right after adding
         l1 = self.analyzer.get_label()
         l2 = self.analyzer.get_label()
-        l3 = self.analyzer.get_label()
-        l4 = self.analyzer.get_label()
-        l5 = self.analyzer.get_label()
-
-        self.clear_reg(res)
-        self.clear_reg(a_cln)
-        self.jzero(b, l4+":F")
-
-        self.set_value(c, 1)
-        self.mov(a_cln, a)
-        self.shl(b)
-        self.shl(c)
-
+        self.jzero(b, end+':F')
         self.target_code.append(l1)
-        self.inc(a)
-        self.sub(a, b)
-        self.jzero(a, l2+':F')
-        self.mov(a, a_cln)
-        self.shl(b)
-        self.shl(c)
+        for _ in range(2):
+            self.jodd(b, l2+':F')
+            self.shl(a)
+            self.shr(b)
         self.jump(l1+':B')
-
         self.target_code.append(l2)
-        self.shr(c)
+        self.add(res, a)
         self.shr(b)
-        self.mov(a, a_cln)
-
-        self.target_code.append(l3)
-        self.jzero(c, l4+':F')
-        self.inc(a)
-        self.sub(a, b)
-        self.jzero(a, l5+':F')
-        self.sub(a_cln, b)
-        self.add(res, c)
-        self.target_code.append(l5)
+        self.jzero(b, end+':F')  # b was odd, so only this may be its last bit
+        self.shl(a)
+        self.jodd(b, l2+':B')
+        self.shl(a)
         self.shr(b)
-        self.shr(c)
-        self.mov(a, a_cln)
-        self.jump(l3+':B')
-        self.target_code.append(l4)
-
-        self.clear_tags(a)
-        self.clear_tags(b)
-        self.clear_tags(c)
+        self.jump(l1+':B')
 
-        return res, a_cln
+    def div(self, rem, other, b, bit, q, check_zero):
+        # restoring division by b, unrolled twice so that the remainder (kept increased by one)
+        # alternates between rem and other instead of being copied back; a quotient bit costs 15,
+        # 2 more with the quotient, and a divisor greater than the dividend ends it after one test
+        l1 = self.analyzer.get_label()
+        l2 = self.analyzer.get_label()
+        l3 = self.analyzer.get_label()
+        l4 = self.analyzer.get_label()
+        l5 = self.analyzer.get_label()
+        zero = self.analyzer.get_label() if check_zero else None
+        if q:
+            self.clear_reg(q)
+        if zero:
+            self.jzero(b, zero+':F')
+        self.inc(rem)
+        self.mov(other, rem)
+        self.sub(other, b)
+        self.target_code.append(l1)  # other = rem - b, saturating to 0 exactly when b passes the dividend
+        self.jzero(other, l2+':F')
+        self.sub(other, b)
+        self.shl(b)
+        self.shl(bit)
+        self.jump(l1+':B')
+        for current, spare, loop, end in ((rem, other, l2, l5), (other, rem, l3, l4)):
+            self.target_code.append(loop)
+            self.shr(b)
+            self.shr(bit)
+            self.jzero(bit, end+':F')
+            if q:
+                self.shl(q)
+            self.mov(spare, current)
+            self.sub(spare, b)
+            self.jzero(spare, loop+':B')
+            if q:
+                self.inc(q)
+        self.jump(l2+':B')
+        self.target_code.append(l4)
+        if not q:
+            self.mov(rem, other)
+        self.target_code.append(l5)
+        if not q:
+            self.dec(rem)
+        if zero and not q:  # the quotient is 0 already, the remainder is not
+            l6 = self.analyzer.get_label()
+            self.jump(l6+':F')
+            self.target_code.append(zero)
+            self.clear_reg(rem)
+            self.target_code.append(l6)
+        elif zero:
+            self.target_code.append(zero)
+        return q or rem
+
+    def odd(self, reg, source):
+        l1 = self.analyzer.get_label()
+        l2 = self.analyzer.get_label()
+        self.clear_reg(reg)
+        self.jodd(source, l1+':F')
+        self.jump(l2+':F')
+        self.target_code.append(l1)
+        self.inc(reg)
+        self.target_code.append(l2)
 
     def clear_reg(self, reg):
         self.target_code.append(f"RESET {reg}")
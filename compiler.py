@@ -2,29 +2,104 @@ from compiler_lexer import CompilerLexer
 from compiler_parser import CompilerParser
 from compiler_analyzer import CompilerAnalyzer
 from code_generator import CompilerCodeGenerator
+from compiler_optimizer import PASSES, CompilerOptimizer
+from compiler_profile import CompileProfile
+import contextlib
 import sys
 
+ALL_PASSES = [name for name, _ in PASSES]
+LEVELS = {
+    # -O0 compiles fastest: no passes, no unrolling, no registers kept over loops, no peephole
+    '-O0': {'passes': [], 'max_rounds': 1, 'unroll_budget': 0, 'allocate_registers': False, 'peephole': False},
+    '-O1': {'passes': ['constant-propagation', 'dead-code', 'value-numbering'], 'max_rounds': 2,
+            'unroll_budget': 120, 'allocate_registers': True, 'peephole': True},
+    '-O2': {'passes': ALL_PASSES, 'max_rounds': 10, 'unroll_budget': 120, 'allocate_registers': True,
+            'peephole': True},
+    # -Os keeps the code short: no unrolling and no copies of loop tests in front of hoisted lines
+    '-Os': {'passes': [name for name in ALL_PASSES if name != 'licm'], 'max_rounds': 10, 'unroll_budget': 0,
+            'allocate_registers': True, 'peephole': True},
+}
 
-if __name__ == '__main__':
-    if len(sys.argv) == 3:
-        lex = CompilerLexer()
-        par = CompilerParser()
-        with open(sys.argv[1], 'r') as input_file:
-            parse_tree = par.parse(lex.tokenize(input_file.read()))
-        # print("Parse Tree:")
-        # for p in parse_tree:
-        #     print(p)
-        sem_analyzer = CompilerAnalyzer(parse_tree)
-        generator = CompilerCodeGenerator(sem_analyzer)
-        target_code = generator.generate()
-        with open(sys.argv[2], 'w') as output_file:
-            for command in target_code:
-                output_file.write(command + "\n")
-    else:
-        print("Usage: python3 compiler.py [input file] [output file]")
 
+def compile_source(source, level='-O2', enable=(), disable=(), max_rounds=None, profile=None):
+    settings = LEVELS[level]
+    passes = [name for name in ALL_PASSES if name in settings['passes'] or name in enable]
+    passes = [name for name in passes if name not in disable]
+
+    def phase(name):
+        return profile.phase(name) if profile else contextlib.nullcontext()
 
+    lex = CompilerLexer()
+    par = CompilerParser()
+    with phase('parse'):
+        parse_tree = par.parse(lex.tokenize(source))
+    # print("Parse Tree:")
+    # for p in parse_tree:
+    #     print(p)
+    with phase('analyze'):
+        sem_analyzer = CompilerAnalyzer(parse_tree, unroll_budget=settings['unroll_budget'])
+    rounds = settings['max_rounds'] if max_rounds is None else max_rounds
+    if profile:
+        profile.intermediate_lines['analyzed'] = len(sem_analyzer.intermediate_code)
+    if passes:
+        optimizer = CompilerOptimizer(sem_analyzer, passes, rounds)
+        with phase('optimize'):
+            optimizer.optimize()
+        if profile:
+            profile.intermediate_lines['optimized'] = len(sem_analyzer.intermediate_code)
+            profile.record_optimizer(optimizer)
+    generator = CompilerCodeGenerator(sem_analyzer, allocate_registers=settings['allocate_registers'])
+    generator.profile = profile
+    if not settings['peephole']:
+        generator.peephole = None
+    target_code = generator.generate()
+    if profile:
+        profile.target_instructions = len(target_code)
+        if generator.peephole:
+            profile.peephole_hits = generator.peephole.hits
+    return target_code
 
 
+def parse_options(args):  # files and keyword arguments of compile_source from the command line
+    files = []
+    options = {'enable': [], 'disable': []}
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if arg in LEVELS:
+            options['level'] = arg
+        elif name in ('--enable', '--disable') and value in ALL_PASSES:
+            options[name[2:]].append(value)
+        elif name == '--max-rounds' and value.isdigit():
+            options['max_rounds'] = int(value)
+        elif name == '--profile':
+            options['profile'] = value or True
+        elif arg.startswith('-'):
+            print(f"Error: unknown option {arg}, passes are {', '.join(ALL_PASSES)}", file=sys.stderr)
+            exit(1)
+        else:
+            files.append(arg)
+    return files, options
 
 
+if __name__ == '__main__':
+    files, options = parse_options(sys.argv[1:])
+    report = options.pop('profile', None)
+    if len(files) == 2:
+        profile = CompileProfile() if report else None
+        with open(files[0], 'r') as input_file:
+            source = input_file.read()
+        if profile:
+            compile_source(source, profile=profile, **options)
+            profile.trace_memory = True
+        target_code = compile_source(source, profile=profile, **options)
+        with open(files[1], 'w') as output_file:
+            for command in target_code:
+                output_file.write(command + "\n")
+        if profile:
+            print(profile.table())
+            if report is not True:
+                with open(report, 'w') as report_file:
+                    report_file.write(profile.json() + "\n")
+    else:
+        print("Usage: python3 compiler.py [-O0|-O1|-O2|-Os] [--enable=pass] [--disable=pass] [--max-rounds=n] "
+              "[--profile[=json file]] [input file] [output file]")
@@ -1,14 +1,18 @@
 import sys
 
+from compiler_ir import derivation
+
+MAX_UNROLL = 4  # copies of the body in one iteration of a partly unrolled loop
+JUMP_OPS = ('=', '<=', '>=')  # conditions the code generator jumps on with a single JZERO
+
 
 class CompilerAnalyzer:
-    def __init__(self, syntax_tree):
+    def __init__(self, syntax_tree, unroll_budget=120):
         self.symbol_table = {}
         self.next_address_pointer = 0
         self.intermediate_code = []
         self.var_counter = 0
         self.label_counter = 0
-        self.loop_counter = 0
         self.reverse_op = {
             '=': '!=',
             '!=': '=',
@@ -28,11 +32,20 @@ class CompilerAnalyzer:
             'READ': self.read,
             'WRITE': self.write
         }
+        self.unroll_budget = unroll_budget  # size of the code a FOR loop with constant bounds may unroll to
+        self.table_addresses = {}  # (table, index) -> temp holding the cell address, within one command
+        self.address_tables = {}  # temp holding the address of a cell of a table by a variable -> the table
+        self.loop_slots = {}  # id of a FOR command -> cells of its iterator, bound and table address
+        self.derived = {}  # (table, iterator) -> cell holding the address of the cell the iterator indexes
+        self.constants = {}  # iterator of an unrolled loop -> its value in the copy of the body
+        self.offsets = {}  # iterator of a partly unrolled loop -> distance of the copy of the body from it
+        self.finite_loops = set()  # head labels of loops known to end, those of FOR loops
         if syntax_tree[0] == 'program':
-            self.declare(syntax_tree[1])
             commands = syntax_tree[2]
+            self.declare(syntax_tree[1], commands)
         else:
             commands = syntax_tree
+            self.declare([], commands)
         self.run(commands)
         self.intermediate_code.append(['HALT'])
         # print("Intermediate Code")
@@ -42,25 +55,207 @@ class CompilerAnalyzer:
     def run(self, commands):
         for c in commands:
             keyword = c[0]
+            self.table_addresses = {}
             self.switch[keyword](c)
+            self.table_addresses = {}
 
-    def declare(self, variables):
+    def declare(self, variables, commands):
+        # scalars, FOR iterators and bounds and the cell used to write constants get the lowest
+        # (cheapest to build) addresses, most used first, unless placing the tables first is cheaper
         for var in variables:
             if var['name'] in self.symbol_table.keys():
                 print(f"Analyzer: {var['name']} already declared", file=sys.stderr)
                 exit(2)
             if var['type'] == 'INT':
-                self.symbol_table[var['name']] = {'type': 'INT', 'address': self.next_address_pointer,
+                self.symbol_table[var['name']] = {'type': 'INT', 'address': None,
                                                   'is_iterator': None, 'initialised': False}
-                self.next_address_pointer += 1
             else:
                 if var['start'] > var['stop']:
                     print(f"Analyzer: Table {var['name']} declaration error:"
                           f"left end is higher than right one.", file=sys.stderr)
                     exit(2)
-                self.symbol_table[var['name']] = {'type': 'TAB', 'address': self.next_address_pointer,
+                self.symbol_table[var['name']] = {'type': 'TAB', 'address': None,
                                                   'start': var['start'], 'stop': var['stop']}
-                self.next_address_pointer += var['stop'] - var['start'] + 1
+        uses = {name: 0 for name in self.symbol_table}
+        uses['WRITE'] = 0
+        loops = {}
+        self.count_uses(commands, {}, 0, uses, loops)
+
+        def is_table(key):
+            return key in self.symbol_table and self.symbol_table[key]['type'] == 'TAB'
+        # a large table in front of the scalars makes all of their addresses expensive, but a hot
+        # one behind them costs its base address on every access, so both layouts are rated
+        layouts = [sorted(uses, key=lambda k: (is_table(k), -uses[k])),
+                   sorted(uses, key=lambda k: (not is_table(k), -uses[k]))]
+        order = min(layouts, key=lambda layout: self.layout_cost(layout, uses))
+        for key in order:
+            uses[key] = self.next_address_pointer
+            if key == 'WRITE':
+                self.write_address = self.next_address_pointer
+            elif key in self.symbol_table:
+                self.symbol_table[key]['address'] = self.next_address_pointer
+            self.next_address_pointer += self.size(key)
+        self.loop_slots = {c: (uses[iterator], uses[bound], {tab: uses[key] for tab, key in derived.items()})
+                           for c, (iterator, bound, derived) in loops.items()}
+
+    def base(self, key):  # accesses to a table build its address - start
+        if key in self.symbol_table and self.symbol_table[key]['type'] == 'TAB':
+            return self.symbol_table[key]['start']
+        return 0
+
+    def size(self, key):
+        if key in self.symbol_table and self.symbol_table[key]['type'] == 'TAB':
+            return self.symbol_table[key]['stop'] - self.symbol_table[key]['start'] + 1
+        return 1
+
+    def layout_cost(self, order, uses):  # uses times the cost of building the address
+        cost = 0
+        address = 0
+        for key in order:
+            cost += uses[key] * derivation(0, abs(address - self.base(key)))[0]
+            address += self.size(key)
+        return cost
+
+    def count_uses(self, commands, scope, depth, uses, loops, stack=0):
+        # static uses weighted by loop depth; FOR loops keep their iterator and bound in the cells
+        # of a stack, so loops that are not nested share them. The iterators of unrolled loops are
+        # mapped to their values in scope
+        weight = 10 ** min(depth, 6)
+        inner = 10 ** min(depth + 1, 6)
+        for c in commands:
+            keyword = c[0]
+            if keyword == 'FOR_TO' or keyword == 'FOR_DOWNTO':
+                self.count_value(c[2], scope, weight, uses)
+                self.count_value(c[3], scope, weight, uses)
+                unrolled = self.unrolling(c, {k: v for k, v in scope.items() if isinstance(v, int)})
+                iterator = ('FOR', stack)
+                bound = ('FOR', stack + 1)  # or the trip counter
+                derived = {}
+                if unrolled:
+                    values, factor = unrolled
+                    for value in self.unrolled_values(values, factor):
+                        self.count_uses(c[4], {**scope, c[1]: value}, depth, uses, loops, stack)
+                    if factor == len(values):
+                        continue
+                else:
+                    tables, direct = self.iterator_uses(c[4], c[1])
+                    if not direct and len(tables) == 1:
+                        derived = {tables.pop(): ('FOR', stack + 2)}
+                    factor = 1
+                loops[id(c)] = (iterator, bound, derived)
+                for key in (iterator, bound, *derived.values()):  # set, then loaded, stepped and stored
+                    uses[key] = uses.get(key, 0) + weight + 3 * inner
+                inner_scope = {**scope, c[1]: iterator, **{(tab, c[1]): key for tab, key in derived.items()}}
+                for _ in range(factor):
+                    self.count_uses(c[4], inner_scope, depth + 1, uses, loops, stack + 2 + len(derived))
+            elif keyword == 'WHILE' or keyword == 'REPEAT':
+                self.count_value(c[1], scope, inner, uses)
+                self.count_uses(c[2], scope, depth + 1, uses, loops, stack)
+            elif keyword == 'IF' or keyword == 'IF_ELSE':
+                self.count_value(c[1], scope, weight, uses)
+                for block in c[2:]:
+                    self.count_uses(block, scope, depth, uses, loops, stack)
+            elif keyword == 'ASSIGN':
+                self.count_value(c[1], scope, weight, uses)
+                self.count_value(c[2], scope, weight, uses)
+            elif keyword == 'WRITE' and c[1][0] == 'NUM':
+                uses['WRITE'] += weight
+            else:  # READ, WRITE
+                self.count_value(c[1], scope, weight, uses)
+
+    def count_value(self, value, scope, weight, uses):
+        if value[0] == 'INT':
+            name = scope.get(value[1], value[1])
+            if name in uses:
+                uses[name] += weight
+        elif value[0] == 'TAB':
+            derived = scope.get((value[1], value[2][1]))
+            if derived:
+                uses[derived] += weight
+                return
+            if value[1] in uses:
+                uses[value[1]] += weight
+            self.count_value(value[2], scope, weight, uses)
+        elif value[0] != 'NUM':  # expression or condition
+            self.count_value(value[1], scope, weight, uses)
+            self.count_value(value[2], scope, weight, uses)
+
+    def iterator_uses(self, commands, name):
+        # tables indexed by the variable name and whether it is used in any other way
+        tables = set()
+        direct = False
+        for value in self.values(commands):
+            if value[0] == 'INT' and value[1] == name:
+                direct = True
+            elif value[0] == 'TAB' and value[2] == ('INT', name):
+                tables.add(value[1])
+        return tables, direct
+
+    def values(self, commands):  # every variable, table cell and number used by the commands
+        for c in commands:
+            parts, blocks = self.parts(c)
+            yield from parts
+            for block in blocks:
+                yield from self.values(block)
+
+    def parts(self, command):  # values used by the command itself and its blocks
+        keyword = command[0]
+        if keyword == 'FOR_TO' or keyword == 'FOR_DOWNTO':
+            parts = [command[2], command[3]]
+            blocks = [command[4]]
+        elif keyword == 'READ' or keyword == 'WRITE':
+            parts = [command[1]]
+            blocks = []
+        elif keyword == 'ASSIGN':
+            parts = [command[1], command[2]]
+            blocks = []
+        else:  # IF, IF_ELSE, WHILE, REPEAT
+            parts = [command[1]]
+            blocks = command[2:]
+        values = []
+        for part in parts:
+            if part[0] in ('NUM', 'INT', 'TAB'):
+                values.append(part)
+            else:
+                values += [part[1], part[2]]
+        return values, blocks
+
+    def code_size(self, commands, constants):  # rough size of the code of the commands, unrolled loops included
+        size = 0
+        for c in commands:
+            parts, blocks = self.parts(c)
+            size += 1 + len(parts)
+            unrolled = self.unrolling(c, constants) if c[0] == 'FOR_TO' or c[0] == 'FOR_DOWNTO' else None
+            for block in blocks:
+                if unrolled:
+                    values, factor = unrolled
+                    size += self.code_size(block, constants) * (factor + len(values) % factor)
+                else:
+                    size += self.code_size(block, constants)
+        return size
+
+    def unrolling(self, command, constants):
+        # iterator values of a FOR loop with constant bounds and the number of copies of its body in
+        # one iteration of the unrolled loop, all of them if it is unrolled completely; None if the
+        # loop stays as it is. Bounds may be iterators of unrolled loops, given by constants
+        first, last = [v[1] if v[0] == 'NUM' else constants.get(v[1]) for v in command[2:4]]
+        if first is None or last is None or not self.unroll_budget:
+            return None
+        values = range(first, last + 1) if command[0] == 'FOR_TO' else range(first, last - 1, -1)
+        if not values:
+            return None
+        size = self.code_size(command[4], constants)
+        if len(values) * size <= self.unroll_budget:
+            return values, len(values)
+        factor = min(self.unroll_budget // size, MAX_UNROLL, len(values) // 2)
+        if factor < 2:
+            return None
+        return values, factor
+
+    def unrolled_values(self, values, factor):  # iterator values of the copies left out of the loop
+        if factor == len(values):
+            return values
+        return values[len(values) - len(values) % factor:]
 
     # ------------------------------------------ assign -----------------------------------------------
     def assign(self, command):
@@ -74,54 +269,23 @@ class CompilerAnalyzer:
             v['initialised'] = True
             self.emit(['ASSIGN', te, left[1]])
         elif left[0] == 'TAB':
-            index = left[2]
-            tab = self.symbol_table[left[1]]
-            if index[0] == 'INT':
-                index_adr = self.symbol_table[index[1]]['address']
-                t = self.get_temp_var()
-                self.emit(['LOAD', index_adr, t])
-                t1 = self.get_temp_var()
-                self.emit(['+', tab['address'], t, t1])
-                if tab['start'] != 0:
-                    t2 = self.get_temp_var()
-                    self.emit(['-', t1, tab['start'], t2])
-                else:
-                    t2 = t1
-                self.emit(['STORE', te, t2])
-            else:
-                address = tab['address'] + index[1] - tab['start']
-                self.emit(['STORE', te, address])
+            self.emit(['STORE', te, self.table_address(left)])
 
     def evaluate_expression(self, right):
         if right[0] == 'INT':
+            if right[1] in self.constants:
+                return self.constants[right[1]]
             t = self.get_temp_var()
             address = self.symbol_table[right[1]]['address']
             self.emit(['LOAD', address, t])
-            return t
+            return self.moved(t, self.offsets.get(right[1], 0))
         elif right[0] == 'NUM':
             return right[1]
         elif right[0] == 'TAB':
-            index = right[2]
-            tab = self.symbol_table[right[1]]
-            if index[0] == 'NUM':
-                address = tab['address'] + index[1] - tab['start']
-                t = self.get_temp_var()
-                self.emit(['LOAD', address, t])
-                return t
-            else:
-                index_adr = self.symbol_table[index[1]]['address']
-                t = self.get_temp_var()
-                self.emit(['LOAD', index_adr, t])
-                t1 = self.get_temp_var()
-                self.emit(['+', tab['address'], t, t1])
-                if tab['start'] != 0:
-                    t2 = self.get_temp_var()
-                    self.emit(['-', t1, tab['start'], t2])
-                else:
-                    t2 = t1
-                t3 = self.get_temp_var()
-                self.emit(['LOAD', t2, t3])
-                return t3
+            address = self.table_address(right)
+            t = self.get_temp_var()
+            self.emit(['LOAD', address, t])
+            return t
         else:  # expression
             op = right[0]
             arg1 = right[1]
@@ -241,6 +405,8 @@ class CompilerAnalyzer:
         self.is_value_valid(arg2)
         t1 = self.evaluate_expression(arg1)
         t2 = self.evaluate_expression(arg2)
+        if op in JUMP_OPS:  # the else block goes first so that the jump is taken on op
+            op, block1, block2 = self.reverse_op[op], block2, block1
         rev_op = self.reverse_op[op]
         l1 = self.get_label()
         l2 = self.get_label()
@@ -253,91 +419,133 @@ class CompilerAnalyzer:
 
     # ------------------------------------------ loops -----------------------------------------------
     def for_to(self, command):
+        self.for_loop(command, 'INC')
+
+    def for_downto(self, command):
+        self.for_loop(command, 'DEC')
+
+    def for_loop(self, command, step):
         iterator = command[1]
         v0 = command[2]
         vk = command[3]
         block = command[4]
         self.is_value_valid(v0)
         self.is_value_valid(vk)
-        self.declare_iterator(iterator, v0)
-        if vk[0] != 'NUM':
-            stop_val = self.get_loop_variable()
-            self.declare_iterator(stop_val, vk)
-        else:
-            stop_val = vk[1]
+        if self.is_declared(iterator):
+            print(f"Analyzer: Duplicate declaration of iterator variable {iterator}", file=sys.stderr)
+            exit(5)
+        unrolled = self.unrolling(command, self.constants)
+        iterator_address, bound_address, derived = self.loop_slots.get(id(command), (None, None, {}))
+        self.symbol_table[iterator] = {'type': 'INT', 'address': iterator_address,
+                                       'is_iterator': True, 'initialised': True}
+        if unrolled:
+            self.unroll(iterator, iterator_address, bound_address, step, block, *unrolled)
+            self.remove_iterator(iterator)
+            return
+        first = self.evaluate_expression(v0)
+        last = self.evaluate_expression(vk)
         l1 = self.get_label()
         l2 = self.get_label()
-
-        self.emit([l1])
-        t = self.get_temp_var()
-        self.emit(['LOAD', self.symbol_table[iterator]['address'], t])
-        if vk[0] != 'NUM':
-            t1 = self.get_temp_var()
-            self.emit(['LOAD', self.symbol_table[stop_val]['address'], t1])
+        self.finite_loops.add(l1)
+        tables, direct = self.iterator_uses(block, iterator)
+        if direct or len(tables) > 1:
+            # tested once in front of the loop, then at its bottom: after the step going up, where
+            # the test is the only jump, and before it going down, where the iterator may reach 0
+            self.emit(['STORE', first, iterator_address])
+            if vk[0] != 'NUM':
+                self.emit(['STORE', last, bound_address])
+            self.emit(['IF', [first, '>' if step == 'INC' else '<', last], 'GOTO', l2+':F'])
+            self.emit([l1])
+            self.run(block)
+            t = self.get_temp_var()
+            self.emit(['LOAD', iterator_address, t])
+            if vk[0] != 'NUM':
+                last = self.get_temp_var()
+                self.emit(['LOAD', bound_address, last])
+            if step == 'DEC':
+                self.emit(['IF', [t, '<=', last], 'GOTO', l2+':F'])
+            self.emit([step, t])
+            self.emit(['STORE', t, iterator_address])
+            if step == 'INC':
+                self.emit(['IF', [t, '<=', last], 'GOTO', l1+':B'])
+            else:
+                self.emit(['GOTO', l1+':B'])
         else:
-            t1 = stop_val
-        self.emit(['IF', [t, '>', t1], 'GOTO', l2+':F'])
-        self.run(block)
-        t2 = self.get_temp_var()
-        self.emit(['LOAD', self.symbol_table[iterator]['address'], t2])
-        self.emit(['INC', t2])
-        self.emit(['STORE', t2, self.symbol_table[iterator]['address']])
-        self.emit(['GOTO', l1+':B'])
+            self.count_down(iterator, first, last, step, bound_address, derived, l1, l2, block)
+            self.emit(['GOTO', l1+':B'])
         self.emit([l2])
         self.remove_iterator(iterator)
-        if vk[0] != 'NUM':
-            self.remove_iterator(stop_val)
-
-    def for_downto(self, command):
-        iterator = command[1]
-        v0 = command[2]
-        vk = command[3]
-        block = command[4]
-        self.is_value_valid(v0)
-        self.is_value_valid(vk)
-        self.declare_iterator(iterator, v0)
-        if vk[0] != 'NUM':
-            stop_val = self.get_loop_variable()
-            self.declare_iterator(stop_val, vk)
-        else:
-            stop_val = vk[1]
-        l1 = self.get_label()
-        l2 = self.get_label()
 
+    def count_down(self, iterator, first, last, step, counter_address, derived, l1, l2, block):
+        # the body uses the iterator only as the index of one table, if at all: the iterations are
+        # counted down to zero instead, so the loop test is a single zero test, and if the table base
+        # is positive the iterator is replaced with the address of the cell it indexes
+        high, low = (last, first) if step == 'INC' else (first, last)
+        t = self.get_temp_var()
+        self.emit(['+', high, 1, t])
+        t1 = self.get_temp_var()
+        self.emit(['-', t, low, t1])  # saturates to no iterations at all
+        self.emit(['STORE', t1, counter_address])
+        steps = [(counter_address, 'DEC')]
+        for tab, address in derived.items():
+            base = self.symbol_table[tab]['address'] - self.symbol_table[tab]['start']
+            if base > 0:
+                t = self.get_temp_var()
+                self.emit(['+', base, first, t])
+                self.derived[(tab, iterator)] = address
+            else:
+                t = first
+                address = self.symbol_table[iterator]['address']
+            self.emit(['STORE', t, address])
+            steps.append((address, step))
         self.emit([l1])
         t = self.get_temp_var()
-        self.emit(['LOAD', self.symbol_table[iterator]['address'], t])
-        if vk[0] != 'NUM':
-            t1 = self.get_temp_var()
-            self.emit(['LOAD', self.symbol_table[stop_val]['address'], t1])
-        else:
-            t1 = stop_val
-        self.emit(['IF', [t, '<', t1], 'GOTO', l2+':F'])
+        self.emit(['LOAD', counter_address, t])
+        self.emit(['IF', [t, '=', 0], 'GOTO', l2+':F'])
         self.run(block)
-        t2 = self.get_temp_var()
-        self.emit(['LOAD', self.symbol_table[iterator]['address'], t2])
-        self.emit(['IF', [t2, '=', 0], 'GOTO', l2 + ':F'])
-        self.emit(['DEC', t2])
-        self.emit(['STORE', t2, self.symbol_table[iterator]['address']])
-        self.emit(['GOTO', l1+':B'])
-        self.emit([l2])
-        self.remove_iterator(iterator)
-        if vk[0] != 'NUM':
-            self.remove_iterator(stop_val)
-
-    def declare_iterator(self, i, init_val):
-        if self.is_declared(i):
-            print(f"Analyzer: Duplicate declaration of iterator variable {i}", file=sys.stderr)
-            exit(5)
-        self.symbol_table[i] = {'type': 'INT', 'address': self.next_address_pointer,
-                                'is_iterator': True, 'initialised': True}
-        t = self.evaluate_expression(init_val)
-        self.emit(['STORE', t, self.next_address_pointer])
-        self.next_address_pointer += 1
+        for address, op in steps:
+            t = self.get_temp_var()
+            self.emit(['LOAD', address, t])
+            self.emit([op, t])
+            self.emit(['STORE', t, address])
+        self.derived = {key: address for key, address in self.derived.items() if key[1] != iterator}
+
+    def unroll(self, iterator, iterator_address, counter_address, step, block, values, factor):
+        # copies of the body with the iterator moved by 0, 1, .. factor - 1 make one iteration of
+        # a loop counting down to zero; in the copies left out of it the iterator is a constant
+        if factor < len(values):
+            steps = [(counter_address, '-', 1)]
+            tables, direct = self.iterator_uses(block, iterator)
+            if direct or tables:
+                self.emit(['STORE', values[0], iterator_address])
+                steps.append((iterator_address, '+' if step == 'INC' else '-', factor))
+            self.emit(['STORE', len(values) // factor, counter_address])
+            l1 = self.get_label()
+            l2 = self.get_label()
+            self.finite_loops.add(l1)
+            self.emit([l1])
+            t = self.get_temp_var()
+            self.emit(['LOAD', counter_address, t])
+            self.emit(['IF', [t, '=', 0], 'GOTO', l2+':F'])
+            for k in range(factor):
+                self.offsets[iterator] = k if step == 'INC' else -k
+                self.run(block)
+            del self.offsets[iterator]
+            for address, op, by in steps:
+                t = self.get_temp_var()
+                self.emit(['LOAD', address, t])
+                t1 = self.get_temp_var()
+                self.emit([op, by, t, t1] if op == '+' else [op, t, by, t1])
+                self.emit(['STORE', t1, address])
+            self.emit(['GOTO', l1+':B'])
+            self.emit([l2])
+        for value in self.unrolled_values(values, factor):
+            self.constants[iterator] = value
+            self.run(block)
+        self.constants.pop(iterator, None)
 
     def remove_iterator(self, i):
         del self.symbol_table[i]
-        self.next_address_pointer -= 1
 
     def while_s(self, command):
         condition = command[1]
@@ -350,12 +558,15 @@ class CompilerAnalyzer:
         rev_op = self.reverse_op[op]
         l1 = self.get_label()
         l2 = self.get_label()
-        self.emit([l1])
         t1 = self.evaluate_expression(arg1)
         t2 = self.evaluate_expression(arg2)
         self.emit(['IF', [t1, rev_op, t2], 'GOTO', l2+':F'])
+        self.emit([l1])
         self.run(block)
-        self.emit(['GOTO', l1+':B'])
+        self.table_addresses = {}
+        t1 = self.evaluate_expression(arg1)
+        t2 = self.evaluate_expression(arg2)
+        self.emit(['IF', [t1, op, t2], 'GOTO', l1+':B'])
         self.emit([l2])
 
     def repeat(self, command):
@@ -389,55 +600,55 @@ class CompilerAnalyzer:
             self.emit(['READ', address])
             v['initialised'] = True
         else:
-            index = var[2]
-            tab = self.symbol_table[var[1]]
-            if index[0] == 'NUM':
-                address = tab['address'] + index[1] - tab['start']
-                self.emit(['READ', address])
-            else:
-                index_adr = self.symbol_table[index[1]]['address']
-                t = self.get_temp_var()
-                self.emit(['LOAD', index_adr, t])
-                t1 = self.get_temp_var()
-                self.emit(['+', tab['address'], t, t1])
-                if tab['start'] != 0:
-                    t2 = self.get_temp_var()
-                    self.emit(['-', t1, tab['start'], t2])
-                else:
-                    t2 = t1
-                self.emit(['READ', t2])
+            self.emit(['READ', self.table_address(var)])
 
     def write(self, command):
         val = command[1]
         self.is_value_valid(val)
-        if val[0] == 'INT':
+        if val[0] == 'INT' and (val[1] in self.constants or val[1] in self.offsets):
+            self.emit(['STORE', self.evaluate_expression(val), self.write_address])
+            self.emit(['WRITE', self.write_address])
+        elif val[0] == 'INT':
             v = self.symbol_table[val[1]]
             address = v['address']
             self.emit(['WRITE', address])
         elif val[0] == 'TAB':
-            index = val[2]
-            tab = self.symbol_table[val[1]]
-            if index[0] == 'NUM':
-                address = tab['address'] + index[1] - tab['start']
-                self.emit(['WRITE', address])
-            else:
-                index_adr = self.symbol_table[index[1]]['address']
-                t = self.get_temp_var()
-                self.emit(['LOAD', index_adr, t])
-                t1 = self.get_temp_var()
-                self.emit(['+', tab['address'], t, t1])
-                if tab['start'] != 0:
-                    t2 = self.get_temp_var()
-                    self.emit(['-', t1, tab['start'], t2])
-                else:
-                    t2 = t1
-                self.emit(['WRITE', t2])
+            self.emit(['WRITE', self.table_address(val)])
         else:  # NUM
-            self.emit(['STORE', val[1], self.next_address_pointer])
-            self.emit(['WRITE', self.next_address_pointer])
+            self.emit(['STORE', val[1], self.write_address])
+            self.emit(['WRITE', self.write_address])
 
     # ------------------------------------------ utils -----------------------------------------------
 
+    def moved(self, t, by):  # temp holding t + by
+        if by == 0:
+            return t
+        t1 = self.get_temp_var()
+        self.emit(['+', by, t, t1] if by > 0 else ['-', t, -by, t1])
+        return t1
+
+    def table_address(self, arg):
+        # address of a table cell: a constant for a constant index, otherwise a temp holding the
+        # index moved by the base address - start, shared by the accesses of one command
+        tab = self.symbol_table[arg[1]]
+        index = arg[2]
+        base = tab['address'] - tab['start']
+        if index[0] == 'NUM':
+            return base + index[1]
+        if index[1] in self.constants:
+            return base + self.constants[index[1]]
+        key = (arg[1], index[1])
+        if key in self.derived and key not in self.table_addresses:
+            t = self.get_temp_var()
+            self.emit(['LOAD', self.derived[key], t])
+            self.table_addresses[key] = t
+        if key not in self.table_addresses:
+            t = self.get_temp_var()
+            self.emit(['LOAD', self.symbol_table[index[1]]['address'], t])
+            self.table_addresses[key] = self.moved(t, base + self.offsets.get(index[1], 0))
+        self.address_tables[self.table_addresses[key]] = arg[1]
+        return self.table_addresses[key]
+
     def is_value_valid(self, arg, to_be_read=False):
         if arg[0] == 'TAB':
             if arg[1] not in self.symbol_table.keys():
@@ -487,9 +698,6 @@ class CompilerAnalyzer:
         self.label_counter += 1
         return 'label'+str(self.label_counter)
 
-    def get_loop_variable(self):
-        self.loop_counter += 1
-        return 'loop'+str(self.loop_counter)
 
 
 
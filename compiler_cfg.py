@@ -0,0 +1,156 @@
+from array import array
+
+from compiler_ir import CompactCode
+
+
+class NaturalLoop:  # a loop head block, the blocks jumping back to it and the blocks of the body no inner loop has
+    __slots__ = ('head', 'latches', 'blocks', 'parent', 'children', 'depth')
+
+    def __init__(self, head, latches):
+        self.head = head
+        self.latches = latches
+        self.blocks = [head]
+        self.parent = None
+        self.children = []
+        self.depth = 1
+
+
+class ControlFlowGraph:
+    # Basic blocks of the intermediate code numbered in code order, with their successors and
+    # predecessors, the blocks reachable from the first one in reverse postorder, the dominator
+    # tree and the natural loops nested in each other. Dominators are found by iterating over the
+    # reverse postorder, which the structured code the analyzer emits lets settle in two rounds,
+    # and loops are found inner first, every block joining the innermost loop it belongs to, so
+    # building the whole graph takes time linear in the length of the code. Blocks no path reaches
+    # have no dominator and are in no loop.
+    def __init__(self, code):
+        compact = CompactCode(code)
+        self.blocks = compact.blocks
+        self.block_of = compact.block_of
+        self.succ = [compact.successors(b) for b in range(len(self.blocks))]
+        self.pred = [compact.predecessors(b) for b in range(len(self.blocks))]
+        self.order = self.reverse_postorder()
+        self.idom = self.dominators()
+        self.enter, self.leave = self.number_tree()
+        self.loops = []
+        self.loop_of = array('i', [-1]) * len(self.blocks)  # block -> its innermost loop in loops, -1 for none
+        self.find_loops()
+
+    def reverse_postorder(self):
+        if not self.blocks:
+            return []
+        post = []
+        seen = bytearray(len(self.blocks))
+        seen[0] = 1
+        stack = [(0, iter(self.succ[0]))]
+        while stack:
+            b, rest = stack[-1]
+            for s in rest:
+                if not seen[s]:
+                    seen[s] = 1
+                    stack.append((s, iter(self.succ[s])))
+                    break
+            else:
+                stack.pop()
+                post.append(b)
+        post.reverse()
+        return post
+
+    def dominators(self):  # immediate dominator of every block, -1 for those not reached, the first its own
+        rank = array('i', [-1]) * len(self.blocks)
+        for k, b in enumerate(self.order):
+            rank[b] = k
+        idom = array('i', [-1]) * len(self.blocks)
+        if not self.order:
+            return idom
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for b in self.order[1:]:
+                new = -1
+                for p in self.pred[b]:
+                    if idom[p] < 0:
+                        continue
+                    if new < 0:
+                        new = p
+                        continue
+                    while p != new:  # the closest common dominator, walking up the one later in the order
+                        while rank[p] > rank[new]:
+                            p = idom[p]
+                        while rank[new] > rank[p]:
+                            new = idom[new]
+                if idom[b] != new:
+                    idom[b] = new
+                    changed = True
+        return idom
+
+    def number_tree(self):  # entry and exit times of a walk over the dominator tree
+        children = [[] for _ in self.blocks]
+        for b in self.order[1:]:
+            children[self.idom[b]].append(b)
+        enter = array('i', [-1]) * len(self.blocks)
+        leave = array('i', [-1]) * len(self.blocks)
+        clock = 0
+        stack = [0] if self.order else []
+        while stack:
+            b = stack.pop()
+            if b < 0:
+                leave[~b] = clock
+                clock += 1
+                continue
+            enter[b] = clock
+            clock += 1
+            stack.append(~b)
+            stack.extend(reversed(children[b]))
+        return enter, leave
+
+    def dominates(self, a, b):  # every path from the start to block b goes through block a
+        return self.enter[b] >= 0 and self.enter[a] <= self.enter[b] and self.leave[b] <= self.leave[a]
+
+    def find_loops(self):
+        # heads later in the order come first, so inner loops are complete when an outer one reaches
+        # them and it takes them in whole, going on from their head
+        for h in reversed(self.order):
+            latches = [p for p in self.pred[h] if self.dominates(h, p)]
+            if not latches:
+                continue
+            loop = NaturalLoop(h, latches)
+            k = len(self.loops)
+            self.loops.append(loop)
+            self.loop_of[h] = k
+            pending = [p for p in latches if p != h]
+            while pending:
+                b = pending.pop()
+                if self.loop_of[b] < 0:
+                    self.loop_of[b] = k
+                    loop.blocks.append(b)
+                    pending.extend(p for p in self.pred[b] if self.enter[p] >= 0)
+                    continue
+                inner = self.loops[self.loop_of[b]]
+                while inner.parent is not None:
+                    inner = inner.parent
+                if inner is not loop:
+                    inner.parent = loop
+                    loop.children.append(inner)
+                    pending.extend(p for p in self.pred[inner.head] if self.enter[p] >= 0 and p not in inner.latches)
+        for loop in reversed(self.loops):  # outer loops come later
+            if loop.parent is not None:
+                loop.depth = loop.parent.depth + 1
+
+    def body(self, loop):  # all blocks of the loop, those of inner loops included
+        blocks = list(loop.blocks)
+        for inner in loop.children:
+            blocks += self.body(inner)
+        return blocks
+
+    def lines(self, loop):
+        # first and last line of a loop whose blocks lie in one piece from its head on, None for others
+        blocks = sorted(self.body(loop))
+        if blocks[0] != loop.head or blocks[-1] - blocks[0] + 1 != len(blocks):
+            return None
+        return self.blocks[blocks[0]][0], self.blocks[blocks[-1]][1] - 1
+
+    def depth(self, b):  # number of loops block b is in
+        k = self.loop_of[b]
+        return self.loops[k].depth if k >= 0 else 0
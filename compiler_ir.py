@@ -0,0 +1,375 @@
+import functools
+from array import array
+
+ARITHMETIC = ('+', '-', '*', '/', '%')
+MIRRORED = {'=': '=', '!=': '!=', '<': '>', '>': '<', '<=': '>=', '>=': '<='}  # a op b is b MIRRORED[op] a
+LABEL, IF, GOTO, HALT, LOAD, STORE, ASSIGN, READ, WRITE, INC, DEC, ADD, SUB, MUL, DIV, MOD = range(16)
+OPCODES = {'IF': IF, 'GOTO': GOTO, 'HALT': HALT, 'LOAD': LOAD, 'STORE': STORE, 'ASSIGN': ASSIGN, 'READ': READ,
+           'WRITE': WRITE, 'INC': INC, 'DEC': DEC, '+': ADD, '-': SUB, '*': MUL, '/': DIV, '%': MOD}
+
+
+def is_temp(arg):
+    return isinstance(arg, str) and arg[0] == 't' and arg[1:].isdigit()
+
+
+def is_label(line):
+    return line[0].startswith('label')
+
+
+def is_jump(line):
+    return line[0] == 'IF' or line[0] == 'GOTO'
+
+
+def jump_target(line):
+    return line[-1].split(':')[0]
+
+
+def uses(line):
+    keyword = line[0]
+    if keyword == 'IF':
+        args = (line[1][0], line[1][2])
+    elif keyword == 'LOAD' or keyword == 'ASSIGN' or keyword == 'INC' or keyword == 'DEC' \
+            or keyword == 'READ' or keyword == 'WRITE':
+        args = (line[1],)
+    elif keyword == 'STORE' or keyword in ARITHMETIC:
+        args = (line[1], line[2])
+    else:
+        return ()
+    return tuple(a for a in args if is_temp(a))
+
+
+def defines(line):
+    keyword = line[0]
+    if keyword == 'LOAD':
+        return line[2]
+    if keyword in ARITHMETIC:
+        return line[3]
+    if keyword == 'INC' or keyword == 'DEC':
+        return line[1]
+    return None
+
+
+def simplify_condition(a, op, b):
+    # the condition [a, op, b] with a constant on the right, comparisons to 0 and 1 turned into zero
+    # tests where they can be, or True or False if it holds for every value of the other operand
+    if isinstance(a, int) and isinstance(b, int):
+        return {'=': a == b, '!=': a != b, '<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[op]
+    if isinstance(a, int):
+        a, op, b = b, MIRRORED[op], a
+    if b == 0:
+        if op == '<' or op == '>=':
+            return op == '>='
+        op = {'<=': '=', '>': '!='}.get(op, op)
+    elif b == 1 and (op == '<' or op == '>='):
+        op = '=' if op == '<' else '!='
+        b = 0
+    return [a, op, b]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def derivation(u, v):
+    # cheapest way from u to v in place: step (INC/DEC) to v >> k, then k times SHL with INC
+    # for every set bit shifted in; returns (cost, k)
+    best = (abs(v - u), 0)
+    for k in range(1, v.bit_length()):
+        cost = abs((v >> k) - u) + k + bin(v & ((1 << k) - 1)).count('1')
+        if cost < best[0]:
+            best = (cost, k)
+    return best
+
+
+def table_ranges(symbol_table):  # first and last address of every table, in the order of the symbol table
+    return [(v['address'], v['address'] + v['stop'] - v['start'])
+            for v in symbol_table.values() if v['type'] == 'TAB']
+
+
+def table_at(tables, address):  # index in tables of the table holding a constant address, None if none does
+    for n, (first, last) in enumerate(tables):
+        if first <= address <= last:
+            return n
+    return None
+
+
+def is_scalar_cell(tables, address):  # a constant address outside of every table
+    return isinstance(address, int) and table_at(tables, address) is None
+
+
+class CompactCode:
+    # The intermediate code as arrays of integers, one entry per line: the opcode, the temporaries it
+    # uses and defines, the label it defines or jumps to and the constant memory cell it reads or
+    # writes (the opcode tells which), -1 where there is none. Temporaries and labels are numbered in
+    # the order they appear in, temps and labels turn the numbers back into names. Over the arrays
+    # lies the control flow graph: basic blocks as line ranges, at most two successors per block
+    # (the jump target first) and the predecessors of block b at pred[pred_start[b]:pred_start[b + 1]].
+    __slots__ = ('op', 'use1', 'use2', 'defined', 'label', 'cell', 'temps', 'labels', 'block_start',
+                 'block_end', 'block_of', 'succ', 'pred_start', 'pred')
+
+    def __init__(self, code, symbol_table=None):
+        self.temps = []
+        self.labels = []
+        temp_ids = {}
+        label_ids = {}
+        ops = []
+        use1 = []
+        use2 = []
+        defined = []
+        labels = []
+        cells = []
+
+        def temp(arg):  # the number of a temporary, -1 for anything else
+            if arg.__class__ is not str:
+                return -1
+            t = temp_ids.get(arg, -1)
+            if t < 0 and is_temp(arg):
+                t = temp_ids[arg] = len(self.temps)
+                self.temps.append(arg)
+            return t
+
+        def label(name):
+            name = name.split(':')[0]
+            k = label_ids.get(name)
+            if k is None:
+                k = label_ids[name] = len(self.labels)
+                self.labels.append(name)
+            return k
+
+        for line in code:
+            keyword = line[0]
+            op = OPCODES.get(keyword, LABEL)
+            a = b = d = target = cell = -1
+            if op == LABEL:
+                target = label(keyword)
+            elif op == IF:
+                a = temp(line[1][0])
+                b = temp(line[1][2])
+                target = label(line[3])
+            elif op == GOTO:
+                target = label(line[1])
+            elif op == STORE:
+                a = temp(line[1])
+                b = temp(line[2])
+                cell = line[2] if isinstance(line[2], int) else -1
+            elif op == ASSIGN:
+                a = temp(line[1])
+                if symbol_table is not None:
+                    cell = symbol_table[line[2]]['address']
+            elif op == LOAD or op == READ or op == WRITE:
+                a = temp(line[1])
+                cell = line[1] if isinstance(line[1], int) else -1
+                if op == LOAD:
+                    d = temp(line[2])
+            elif op == INC or op == DEC:
+                a = d = temp(line[1])
+            elif op != HALT:
+                a = temp(line[1])
+                b = temp(line[2])
+                d = temp(line[3])
+            ops.append(op)
+            use1.append(a)
+            use2.append(b)
+            defined.append(d)
+            labels.append(target)
+            cells.append(cell)
+        self.op = array('b', ops)
+        self.use1 = array('i', use1)
+        self.use2 = array('i', use2)
+        self.defined = array('i', defined)
+        self.label = array('i', labels)
+        self.cell = array('q', cells)
+        self.build_graph()
+
+    def build_graph(self):
+        op = self.op
+        self.block_start = array('i')
+        self.block_end = array('i')
+        start = 0
+        for i in range(len(op)):
+            if op[i] == LABEL and i > start:
+                self.block_start.append(start)
+                self.block_end.append(i)
+                start = i
+            if op[i] == IF or op[i] == GOTO or op[i] == HALT:
+                self.block_start.append(start)
+                self.block_end.append(i + 1)
+                start = i + 1
+        if start < len(op):
+            self.block_start.append(start)
+            self.block_end.append(len(op))
+        count = len(self.block_start)
+        self.block_of = array('i', bytes(4 * len(op)))
+        block_at = array('i', bytes(4 * len(self.labels)))
+        for b in range(count):
+            start = self.block_start[b]
+            for i in range(start, self.block_end[b]):
+                self.block_of[i] = b
+            if op[start] == LABEL:
+                block_at[self.label[start]] = b
+        self.succ = array('i', [-1]) * (2 * count)
+        self.pred_start = array('i', bytes(4 * (count + 1)))
+        for b in range(count):
+            last = self.block_end[b] - 1
+            k = 2 * b
+            if op[last] == IF or op[last] == GOTO:
+                self.succ[k] = block_at[self.label[last]]
+                k += 1
+            if op[last] != GOTO and op[last] != HALT and b + 1 < count:
+                self.succ[k] = b + 1
+        for s in self.succ:
+            if s >= 0:
+                self.pred_start[s + 1] += 1
+        for b in range(count):
+            self.pred_start[b + 1] += self.pred_start[b]
+        self.pred = array('i', bytes(4 * self.pred_start[count]))
+        filled = array('i', self.pred_start)
+        for k, s in enumerate(self.succ):
+            if s >= 0:
+                self.pred[filled[s]] = k // 2
+                filled[s] += 1
+
+    @property
+    def blocks(self):  # (start, end) pairs, end exclusive
+        return list(zip(self.block_start, self.block_end))
+
+    def successors(self, b):
+        return [s for s in self.succ[2 * b:2 * b + 2] if s >= 0]
+
+    def predecessors(self, b):
+        return self.pred[self.pred_start[b]:self.pred_start[b + 1]].tolist()
+
+
+class BitSets:  # read-only list of sets kept as bits of integers, bit k standing for names[k]
+    __slots__ = ('bits', 'names')
+
+    def __init__(self, bits, names):
+        self.bits = bits
+        self.names = names
+
+    def __len__(self):
+        return len(self.bits)
+
+    def __getitem__(self, b):
+        return {self.names[k] for k in ones(self.bits[b])}
+
+    def __iter__(self):
+        return (self[b] for b in range(len(self.bits)))
+
+
+def ones(bits):  # positions of the set bits
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def backward_dataflow(gen, kill, succ):
+    # live in and out of every block as bits, from gen and kill bits and the two successor slots of
+    # every block in succ, -1 for none
+    live_in = list(gen)
+    live_out = [0] * len(gen)
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(range(len(gen))):
+            out = 0
+            for s in succ[2 * b:2 * b + 2]:
+                if s >= 0:
+                    out |= live_in[s]
+            if out != live_out[b]:
+                live_out[b] = out
+                live_in[b] = gen[b] | (out & ~kill[b])
+                changed = True
+    return live_in, live_out
+
+
+class Liveness:  # backward liveness of temporaries, live_out per basic block
+    def __init__(self, code):
+        compact = CompactCode(code)
+        self.temp_ids = {t: k for k, t in enumerate(compact.temps)}
+        self.blocks = compact.blocks
+        self.block_of = compact.block_of
+        self.last_use = []  # per block: id of a temporary -> last line using it
+        gen = []
+        kill = []
+        for start, end in self.blocks:
+            g = k = 0
+            last_use = {}
+            for i in range(start, end):
+                for t in (compact.use1[i], compact.use2[i]):
+                    if t >= 0:
+                        last_use[t] = i
+                        if not k >> t & 1:
+                            g |= 1 << t
+                if compact.defined[i] >= 0:
+                    k |= 1 << compact.defined[i]
+            gen.append(g)
+            kill.append(k)
+            self.last_use.append(last_use)
+        live_in, live_out = backward_dataflow(gen, kill, compact.succ)
+        self.live_in = BitSets(live_in, compact.temps)
+        self.live_out = BitSets(live_out, compact.temps)
+
+    def is_live_after(self, temp, i):
+        t = self.temp_ids.get(temp)
+        if t is None:
+            return False
+        b = self.block_of[i]
+        return bool(self.live_out.bits[b] >> t & 1) or self.last_use[b].get(t, -1) > i
+
+
+class ScalarLiveness:  # backward liveness of memory cells addressed by constants outside of tables
+    def __init__(self, code, symbol_table):
+        self.symbol_table = symbol_table
+        self.tables = table_ranges(symbol_table)
+        compact = CompactCode(code, symbol_table)
+        self.blocks = compact.blocks
+        self.block_at = {start: b for b, (start, end) in enumerate(self.blocks)}
+        bit_of = {}  # scalar cell -> its bit, None for a table cell
+        cells = []
+        gen = []
+        kill = []
+        for start, end in self.blocks:
+            g = k = 0
+            for i in range(start, end):
+                cell = compact.cell[i]
+                if cell < 0:
+                    continue
+                if cell not in bit_of:
+                    bit_of[cell] = len(cells) if self.is_scalar_cell(cell) else None
+                    if bit_of[cell] is not None:
+                        cells.append(cell)
+                bit = bit_of[cell]
+                if bit is None:
+                    continue
+                op = compact.op[i]
+                if op == LOAD or op == WRITE:
+                    if not k >> bit & 1:
+                        g |= 1 << bit
+                else:
+                    k |= 1 << bit
+            gen.append(g)
+            kill.append(k)
+        live_in, live_out = backward_dataflow(gen, kill, compact.succ)
+        self.live_in = BitSets(live_in, cells)
+        self.live_out = BitSets(live_out, cells)
+
+    def is_scalar_cell(self, address):
+        return is_scalar_cell(self.tables, address)
+
+    def cell_uses(self, line):
+        keyword = line[0]
+        if (keyword == 'LOAD' or keyword == 'WRITE') and self.is_scalar_cell(line[1]):
+            return (line[1],)
+        return ()
+
+    def cell_defined(self, line):
+        keyword = line[0]
+        if keyword == 'ASSIGN':
+            return self.symbol_table[line[2]]['address']
+        if keyword == 'STORE' and self.is_scalar_cell(line[2]):
+            return line[2]
+        if keyword == 'READ' and self.is_scalar_cell(line[1]):
+            return line[1]
+        return None
+
+    def live_at(self, i):  # cells live on entry to the basic block starting at line i
+        return self.live_in[self.block_at[i]]
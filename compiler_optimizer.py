@@ -0,0 +1,1133 @@
+import time
+
+from compiler_cfg import ControlFlowGraph
+from compiler_ir import ARITHMETIC, Liveness, ScalarLiveness, defines, derivation, is_jump, is_label, is_scalar_cell, \
+    is_temp, jump_target, simplify_condition, table_at, table_ranges, uses
+from compiler_ssa import SSAForm
+
+UNKNOWN = object()  # value of an SSA version no line defining it has run yet
+
+
+def fold(op, a, b):  # arithmetic as the machine does it
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b if a > b else 0
+    if op == '*':
+        return a * b
+    if op == '/':
+        return a // b if b else 0
+    return a % b if b else 0
+
+
+def compare(a, op, b):
+    if op == '=':
+        return a == b
+    if op == '!=':
+        return a != b
+    if op == '<':
+        return a < b
+    if op == '>':
+        return a > b
+    if op == '<=':
+        return a <= b
+    return a >= b
+
+
+def address_cost(address):  # building a constant address and loading from it
+    return 21 + derivation(0, address)[0]
+
+
+def line_cost(line):  # rough cost of running a line of the intermediate code
+    keyword = line[0]
+    if keyword == 'LOAD' or keyword == 'STORE' or keyword == 'ASSIGN':
+        address = line[1] if keyword == 'LOAD' else line[2]
+        return address_cost(address) if isinstance(address, int) else 21
+    if keyword == '+' or keyword == '-':
+        return 5
+    if keyword in ARITHMETIC:
+        return 50
+    if keyword == 'WRITE':
+        return 100 + (address_cost(line[1]) if isinstance(line[1], int) else 21)
+    if keyword == 'IF':
+        return 6
+    return 1
+
+
+class PartialEvaluation:
+    # Runs the program at compile time until it needs an input, reads a cell nothing has written yet
+    # or runs out of fuel. The code run so far is replaced by stores of the cells it left behind that
+    # the rest of the program may read, followed by the values it wrote. The rest starts at the last
+    # point passed with no temporaries live and outside of every loop, so it needs no jump into it.
+    # A program run to its end is replaced by its output alone.
+    def __init__(self, code, analyzer, fuel=100000):
+        self.code = code
+        self.analyzer = analyzer
+        self.fuel = fuel
+        self.tables = table_ranges(analyzer.symbol_table)
+        self.changes = 0
+
+    def run(self):
+        code = self.code
+        resume, memory, written, cost = self.evaluate(self.clean_points())
+        if resume is None:
+            rest = [['HALT']]
+            stores = []
+        else:
+            rest = code[resume:]
+            stores = [['STORE', memory[a], a] for a in sorted(self.needed(resume, memory))]
+        if all(line[0] == 'STORE' and isinstance(line[1], int) and isinstance(line[2], int)
+               or line[0] == 'WRITE' and isinstance(line[1], int) or line[0] == 'HALT' for line in code[:resume]):
+            return code  # nothing left to evaluate
+        prefix = [line for line in stores if line[2] != self.analyzer.write_address]
+        stored = {line[2] for line in prefix}
+        for address, value in written:
+            if address in stored and memory[address] == value:
+                prefix.append(['WRITE', address])
+            else:
+                prefix.append(['STORE', value, self.analyzer.write_address])
+                prefix.append(['WRITE', self.analyzer.write_address])
+        prefix += [line for line in stores if line[2] == self.analyzer.write_address]
+        if sum(line_cost(line) + (derivation(0, line[1])[0] if line[0] == 'STORE' else 0)
+               for line in prefix) >= cost:
+            return code
+        self.changes = len(code) - len(rest)
+        return prefix + rest
+
+    def clean_points(self):  # lines no temporary is live in front of and no loop spans
+        code = self.code
+        clean = [True] * len(code)
+        cfg = ControlFlowGraph(code)
+        for b, (start, end) in enumerate(cfg.blocks):
+            k = cfg.loop_of[b]
+            if k >= 0:
+                outermost_head = cfg.loops[k].head == b and cfg.loops[k].parent is None
+                for i in range(start + outermost_head, end):
+                    clean[i] = False
+        liveness = Liveness(code)
+        for b, (start, end) in enumerate(liveness.blocks):
+            live = set(liveness.live_out[b])
+            for i in reversed(range(start, end)):
+                t = defines(code[i])
+                live.discard(t)
+                live.update(uses(code[i]))
+                if live:
+                    clean[i] = False
+        return clean
+
+    def evaluate(self, clean):
+        # returns the line to resume at (None if the program has ended) with the memory, the
+        # written (address, value) pairs and the cost of what was run up to that line
+        code = self.code
+        labels = {line[0]: i for i, line in enumerate(code) if is_label(line)}
+        symbol_table = self.analyzer.symbol_table
+        memory = {}
+        temps = {}
+        written = []
+        journal = []  # (address, old value) of the cells changed since the last clean point
+        snapshot = (0, 0, 0)
+        cost = 0
+        pc = 0
+
+        def value(arg):
+            return temps[arg] if is_temp(arg) else arg
+
+        def store(address, val):
+            journal.append((address, memory.get(address)))
+            memory[address] = val
+
+        for _ in range(self.fuel):
+            if clean[pc]:
+                snapshot = (pc, len(written), cost)
+                journal = []
+            line = code[pc]
+            keyword = line[0]
+            cost += line_cost(line)
+            pc += 1
+            if keyword == 'HALT':
+                return None, memory, written, cost
+            if keyword == 'READ':
+                break
+            if keyword == 'LOAD' or keyword == 'WRITE':
+                address = value(line[1])
+                if address not in memory:
+                    break
+                if keyword == 'LOAD':
+                    temps[line[2]] = memory[address]
+                else:
+                    written.append((address, memory[address]))
+            elif keyword == 'STORE':
+                store(value(line[2]), value(line[1]))
+            elif keyword == 'ASSIGN':
+                store(symbol_table[line[2]]['address'], value(line[1]))
+            elif keyword in ARITHMETIC:
+                temps[line[3]] = fold(keyword, value(line[1]), value(line[2]))
+            elif keyword == 'INC' or keyword == 'DEC':
+                temps[line[1]] = fold('+' if keyword == 'INC' else '-', temps[line[1]], 1)
+            elif keyword == 'GOTO':
+                pc = labels[jump_target(line)]
+            elif keyword == 'IF':
+                a, op, b = line[1]
+                if compare(value(a), op, value(b)):
+                    pc = labels[jump_target(line)]
+        for address, old in reversed(journal):
+            if old is None:
+                del memory[address]
+            else:
+                memory[address] = old
+        resume, writes, cost = snapshot
+        return resume, memory, written[:writes], cost
+
+    def needed(self, resume, memory):  # cells of the memory the code from the line on may read
+        code = self.code
+        cells = ScalarLiveness(code, self.analyzer.symbol_table)
+        blocks = cells.blocks
+        b = max(b for b, (start, end) in enumerate(blocks) if start <= resume)
+        live = set(cells.live_out[b])
+        for i in reversed(range(resume, blocks[b][1])):
+            live.discard(cells.cell_defined(code[i]))
+            live.update(cells.cell_uses(code[i]))
+        read = set()
+        anywhere = False
+        for line in code[resume:]:
+            if line[0] == 'LOAD' or line[0] == 'WRITE':
+                if is_temp(line[1]):
+                    anywhere = True
+                else:
+                    read.add(line[1])
+        return {a for a in memory if a in live or not is_scalar_cell(self.tables, a) and (anywhere or a in read)}
+
+
+class ConstantPropagation:
+    # Forward dataflow over memory cells at constant addresses and temporaries. A cell keeps its
+    # constant on a block entry only if every predecessor agrees on it. Known temporaries are
+    # replaced by their values, arithmetic on constants is folded and decided conditions become
+    # plain jumps or disappear. A temporary stays known only into the block its block falls through
+    # to without a label, the only one it can live into, and the line defining it then stays.
+    def __init__(self, code, analyzer):
+        self.code = code
+        self.symbol_table = analyzer.symbol_table
+        self.tables = table_ranges(self.symbol_table)
+        self.cfg = ControlFlowGraph(code)
+        self.blocks = self.cfg.blocks
+        self.shared = set().union(*Liveness(code).live_out)
+        self.changes = 0
+
+    def run(self):
+        entry = self.solve()
+        code = []
+        for b, (start, end) in enumerate(self.blocks):
+            known = dict(entry[b]) if entry[b] is not None else {}
+            for i in range(start, end):
+                line = self.transfer(self.code[i], known)
+                if line != self.code[i]:
+                    self.changes += 1
+                if line is not None:
+                    code.append(line)
+        return code
+
+    def solve(self):
+        entry = [None] * len(self.blocks)
+        if self.blocks:
+            entry[0] = {}
+        changed = True
+        while changed:
+            changed = False
+            for b in self.cfg.order:
+                if entry[b] is None:
+                    continue
+                start, end = self.blocks[b]
+                known = dict(entry[b])
+                for i in range(start, end):
+                    self.transfer(self.code[i], known)
+                cells = {k: v for k, v in known.items() if not is_temp(k)}
+                for s in self.cfg.succ[b]:
+                    out = known if s == b + 1 and not is_label(self.code[self.blocks[s][0]]) else cells
+                    if entry[s] is None:
+                        entry[s] = out
+                        changed = True
+                    else:
+                        meet = {k: v for k, v in entry[s].items() if out.get(k) == v}
+                        if len(meet) != len(entry[s]):
+                            entry[s] = meet
+                            changed = True
+        return entry
+
+    def write_cell(self, known, address, value):
+        if is_temp(address):
+            for k in [k for k in known if not is_temp(k) and not is_scalar_cell(self.tables, k)]:
+                del known[k]
+        elif isinstance(value, int):
+            known[address] = value
+        else:
+            known.pop(address, None)
+
+    def define(self, known, temp, value):  # False if the line defining temp has to stay
+        known[temp] = value
+        return temp not in self.shared
+
+    def transfer(self, line, known):
+        # returns the line with known operands replaced, or None if it is no longer needed,
+        # and updates the known values
+        def value(arg):
+            return known.get(arg, arg) if is_temp(arg) else arg
+        keyword = line[0]
+        if keyword == 'LOAD':
+            address = value(line[1])
+            known.pop(line[2], None)
+            if isinstance(address, int) and address in known and self.define(known, line[2], known[address]):
+                return None
+            return ['LOAD', address, line[2]]
+        if keyword in ARITHMETIC:
+            a = value(line[1])
+            b = value(line[2])
+            known.pop(line[3], None)
+            if isinstance(a, int) and isinstance(b, int) and self.define(known, line[3], fold(keyword, a, b)):
+                return None
+            return [keyword, a, b, line[3]]
+        if keyword == 'INC' or keyword == 'DEC':
+            if line[1] in known:
+                known[line[1]] = fold('+' if keyword == 'INC' else '-', known[line[1]], 1)
+                return None
+            return line
+        if keyword == 'STORE':
+            val = value(line[1])
+            address = value(line[2])
+            self.write_cell(known, address, val)
+            return ['STORE', val, address]
+        if keyword == 'ASSIGN':
+            val = value(line[1])
+            self.write_cell(known, self.symbol_table[line[2]]['address'], val)
+            return ['ASSIGN', val, line[2]]
+        if keyword == 'READ':
+            address = value(line[1])
+            self.write_cell(known, address, None)
+            return ['READ', address]
+        if keyword == 'WRITE':
+            return ['WRITE', value(line[1])]
+        if keyword == 'IF':
+            a, op, b = line[1]
+            a = value(a)
+            b = value(b)
+            condition = compare(a, op, b) if isinstance(a, int) and isinstance(b, int) \
+                else simplify_condition(a, op, b)
+            if condition is True:
+                return ['GOTO', line[3]]
+            if condition is False:
+                return None
+            return ['IF', condition, line[2], line[3]]
+        return line
+
+
+class SparseConditionalConstantPropagation(ConstantPropagation):
+    # Constant propagation on the SSA form of the scalar cells. A version is unknown until a line
+    # or a phi defining it runs, then a constant, and varies once two different values meet; None
+    # stands for that. Only the edges a condition may take are followed, so values from paths no run
+    # takes do not spoil a phi and blocks behind decided conditions are never visited. A block is
+    # visited again only when a version it reads changes or another edge into it opens. The lines
+    # are rewritten by the transfer of ConstantPropagation, every read of a cell seeing the value of
+    # the version it reads.
+    def __init__(self, code, analyzer):
+        super().__init__(code, analyzer)
+        self.ssa = SSAForm(code, self.symbol_table, self.cfg)
+        self.values = {}  # version -> its constant, None if it varies, no entry while unknown
+        self.users = {}  # version -> blocks reading it in a line or a phi
+        for i, v in self.ssa.read.items():
+            self.users.setdefault(v, set()).add(self.cfg.block_of[i])
+        for b, phis in enumerate(self.ssa.phis):
+            for v in phis.values():
+                for _, u in self.ssa.args[v]:
+                    self.users.setdefault(u, set()).add(b)
+        self.reached = set()
+        self.taken = set()  # edges (block, successor) some run may take
+        self.temps_in = {}  # block -> temporaries known on entry to it, falling through from the one in front
+
+    def run(self):
+        self.solve()
+        code = []
+        for b, (start, end) in enumerate(self.blocks):
+            if b not in self.reached:
+                code += self.code[start:end]  # left for DeadCodeElimination
+                continue
+            known = dict(self.temps_in.get(b, {}))
+            for i in range(start, end):
+                line = self.evaluate(i, known)
+                if line != self.code[i]:
+                    self.changes += 1
+                if line is not None:
+                    code.append(line)
+        return code
+
+    def solve(self):
+        pending = [0] if self.blocks else []
+        self.reached.update(pending)
+        while pending:
+            self.visit(pending.pop(), pending)
+
+    def visit(self, b, pending):
+        for v in self.ssa.phis[b].values():
+            value = UNKNOWN
+            for p, u in self.ssa.args[v]:
+                if (p, b) in self.taken:
+                    value = meet(value, self.values.get(u, UNKNOWN))
+            self.lower(v, value, pending)
+        start, end = self.blocks[b]
+        known = dict(self.temps_in.get(b, {}))
+        line = None
+        for i in range(start, end):
+            line = self.evaluate(i, known)
+            v = self.ssa.written.get(i)
+            if v is not None:
+                self.lower(v, known.get(self.ssa.cell_of[v]), pending)
+        keyword = self.code[end - 1][0]
+        successors = []
+        if keyword == 'GOTO' or keyword == 'IF' and line is not None and line[0] == 'GOTO':
+            successors.append(self.cfg.succ[b][0])
+        elif keyword == 'IF' and line is not None:
+            successors += self.cfg.succ[b]
+        elif keyword != 'HALT' and b + 1 < len(self.blocks):
+            successors.append(b + 1)
+        for s in successors:
+            if s == b + 1 and not is_label(self.code[self.blocks[s][0]]):
+                temps = {k: v for k, v in known.items() if is_temp(k)}
+                if temps != self.temps_in.get(s, {}):
+                    self.temps_in[s] = temps
+                    pending.append(s)
+            if (b, s) not in self.taken:
+                self.taken.add((b, s))
+                self.reached.add(s)
+                pending.append(s)
+
+    def evaluate(self, i, known):  # the line rewritten, the cell it reads taking the value of its version
+        v = self.ssa.read.get(i)
+        if v is not None:
+            value = self.values.get(v)
+            if isinstance(value, int):
+                known[self.ssa.cell_of[v]] = value
+            else:
+                known.pop(self.ssa.cell_of[v], None)
+        return self.transfer(self.code[i], known)
+
+    def lower(self, v, value, pending):
+        old = self.values.get(v, UNKNOWN)
+        new = meet(old, value)
+        if new is not old and new != old:
+            self.values[v] = new
+            pending.extend(b for b in self.users.get(v, ()) if b in self.reached)
+
+
+def meet(a, b):  # of two SSA values, None for varying
+    if a is UNKNOWN:
+        return b
+    if b is UNKNOWN or a == b:
+        return a
+    return None
+
+
+class CopyPropagation:
+    # A scalar cell stored straight from a load of another one, or a phi joining the same version
+    # on every edge, holds a copy of a version. Lines reading the copy read the original instead
+    # wherever its cell still holds it, the two versions then sharing one cell as SSAForm allows,
+    # and DeadCodeElimination drops the stores of copies nobody reads any more.
+    def __init__(self, code, analyzer):
+        self.code = code
+        self.cfg = ControlFlowGraph(code)
+        self.ssa = SSAForm(code, analyzer.symbol_table, self.cfg)
+        self.changes = 0
+
+    def run(self):
+        ssa = self.ssa
+        source = {}  # version -> version it copies
+        for start, end in self.cfg.blocks:
+            loaded = {}  # temp -> version it holds
+            for i in range(start, end):
+                line = self.code[i]
+                loaded.pop(defines(line), None)
+                if line[0] == 'LOAD' and i in ssa.read:
+                    loaded[line[2]] = ssa.read[i]
+                elif (line[0] == 'STORE' or line[0] == 'ASSIGN') and i in ssa.written and line[1] in loaded:
+                    source[ssa.written[i]] = loaded[line[1]]
+        changed = True
+        while changed:
+            changed = False
+            for phis in ssa.phis:
+                for v in phis.values():
+                    origins = {self.original(source, u) for _, u in ssa.args[v]} - {v}
+                    if len(origins) == 1 and v not in source:
+                        source[v] = origins.pop()
+                        changed = True
+        queries = {}
+        for i, v in ssa.read.items():
+            u = self.original(source, v)
+            if ssa.cell_of[u] != ssa.cell_of[v]:
+                queries[i] = ssa.cell_of[u]
+        found = ssa.versions_at(queries)
+        code = list(self.code)
+        for i, cell in queries.items():
+            if found[i] == self.original(source, ssa.read[i]):
+                code[i] = [code[i][0], cell] + code[i][2:]
+                self.changes += 1
+        return code
+
+    def original(self, source, v):
+        while v in source:
+            v = source[v]
+        return v
+
+
+class DeadCodeElimination:
+    # Removes the blocks no path from the start reaches, the FOR loops whose work nobody sees, the
+    # lines computing temporaries nobody uses and the stores to scalar cells overwritten or never
+    # read before the program ends. A loop goes only if it may not run forever, so WHILE and REPEAT
+    # loops stay and so do the loops around them. Jumps to the line right after them and labels no
+    # jump goes to are dropped too.
+    def __init__(self, code, analyzer):
+        self.code = code
+        self.symbol_table = analyzer.symbol_table
+        self.finite_loops = analyzer.finite_loops
+        self.changes = 0
+
+    def run(self):
+        code = self.reachable(self.code)
+        code = self.remove_loops(code)
+        code = self.remove_dead(code)
+        code = self.remove_jumps(code)
+        self.changes = len(self.code) - len(code)
+        return code
+
+    def reachable(self, code):
+        cfg = ControlFlowGraph(code)
+        return [line for b in sorted(cfg.order) for line in code[cfg.blocks[b][0]:cfg.blocks[b][1]]]
+
+    def remove_loops(self, code):
+        removed = True
+        while removed:
+            removed = False
+            cfg = ControlFlowGraph(code)
+            found = [loop for loop in cfg.loops if self.is_finite(code, cfg, loop)]
+            if not found:
+                break
+            cells = ScalarLiveness(code, self.symbol_table)
+            for loop in sorted(found, key=lambda loop: loop.head):  # outer loops first
+                span = self.span(code, cfg, loop)
+                if span is not None and self.is_removable(code, span[0], span[1], cells):
+                    code = code[:span[0]] + code[span[1] + 1:]
+                    removed = True
+                    break
+        return code
+
+    def is_finite(self, code, cfg, loop):  # the loop and every loop inside it are known to end
+        return code[cfg.blocks[loop.head][0]][0] in self.finite_loops \
+            and all(self.is_finite(code, cfg, inner) for inner in loop.children)
+
+    def span(self, code, cfg, loop):
+        # first and last line of a loop whose blocks lie in one piece from its head on, entered only
+        # by falling into its head and left only for the label right after it, None for other loops
+        lines = cfg.lines(loop)
+        if lines is None:
+            return None
+        head, end = lines
+        first = loop.head
+        last = cfg.block_of[end]
+        if last + 1 >= len(cfg.blocks) or not is_label(code[end + 1]):
+            return None
+        for b in range(first, last + 1):
+            if any(s < first or s > last + 1 for s in cfg.succ[b]):
+                return None
+            for p in cfg.pred[b]:
+                if first <= p <= last:
+                    continue
+                if p != first - 1 or b != first \
+                        or is_jump(code[head - 1]) and jump_target(code[head - 1]) == code[head][0]:
+                    return None
+        return head, end
+
+    def is_removable(self, code, head, end, cells):  # the loop has no effect beyond its end
+        live = cells.live_at(end + 1)
+        for line in code[head:end + 1]:
+            keyword = line[0]
+            if keyword == 'READ' or keyword == 'WRITE' or keyword == 'HALT':
+                return False
+            if keyword == 'STORE' or keyword == 'ASSIGN':
+                cell = cells.cell_defined(line)
+                if cell is None or cell in live:
+                    return False
+        return True
+
+    def remove_dead(self, code):
+        while True:
+            liveness = Liveness(code)
+            cells = ScalarLiveness(code, self.symbol_table)
+            kept = []
+            for b in reversed(range(len(liveness.blocks))):
+                start, end = liveness.blocks[b]
+                live = set(liveness.live_out[b])
+                live_cells = set(cells.live_out[b])
+                for i in reversed(range(start, end)):
+                    line = code[i]
+                    t = defines(line)
+                    cell = cells.cell_defined(line)
+                    if t is not None and t not in live:
+                        continue  # no line defining a temporary has any other effect
+                    if (line[0] == 'STORE' or line[0] == 'ASSIGN') and cell is not None and cell not in live_cells:
+                        continue
+                    live.discard(t)
+                    live.update(uses(line))
+                    live_cells.discard(cell)
+                    live_cells.update(cells.cell_uses(line))
+                    kept.append(line)
+            if len(kept) == len(code):
+                return code
+            code = kept[::-1]
+
+    def remove_jumps(self, code):
+        kept = []
+        for i, line in enumerate(code):
+            if is_jump(line):
+                j = i + 1
+                while j < len(code) and is_label(code[j]) and code[j][0] != jump_target(line):
+                    j += 1
+                if j < len(code) and is_label(code[j]):
+                    continue
+            kept.append(line)
+        targets = {jump_target(line) for line in kept if is_jump(line)}
+        return [line for line in kept if not is_label(line) or line[0] in targets]
+
+
+class Numbering:  # what is known at a point of a stretch of code
+    def __init__(self, facts=None):
+        self.generation = {}  # scalar cell -> number of writes to it so far
+        self.values = {}  # temporary -> number of its value
+        self.holders = {}  # number of a value -> temporary holding it
+        self.memory = {}  # number of a cell content -> number of the value in it
+        self.cells = {}  # number of a value -> (scalar cell, generation) holding it
+        for cell, value in (facts or {}).items():
+            self.memory[('cell', cell, 0)] = value
+            self.cells[value] = (cell, 0)
+
+
+class ValueNumbering:
+    # Every value gets a number made of its operation and the numbers of its operands, so equal
+    # computations get equal numbers. The content of a scalar cell is numbered by the cell and the
+    # count of writes to it, that of a table cell by its address, and a store makes it the number of
+    # the stored value. A store to a table cell forgets the cells it may be, by the table its address
+    # falls in and by the distance from other addresses with the same index.
+    # Between two labels temporaries survive, so a value computed again, or loaded from a cell it was
+    # stored to, is taken from the temporary already holding it if that saves more than keeping the
+    # register and the registers suffice. Across labels a forward dataflow keeps track of the scalar
+    # cells holding values made of scalar cells, and a product or quotient found in one of them is
+    # loaded instead of computed again.
+    def __init__(self, code, analyzer):
+        self.code = code
+        self.symbol_table = analyzer.symbol_table
+        self.tables = table_ranges(self.symbol_table)
+        names = [name for name, v in self.symbol_table.items() if v['type'] == 'TAB']
+        # temp the analyzer built the address of a table cell in -> index of that table in tables
+        self.address_tables = {t: names.index(name) for t, name in analyzer.address_tables.items()}
+        self.table_numbers = {}  # number of a computed address -> its table, None if unknown
+        self.cfg = ControlFlowGraph(code)
+        self.blocks = self.cfg.blocks
+        liveness = Liveness(code)
+        self.crossing = set()  # temporaries live into a label
+        for b, (start, end) in enumerate(self.blocks):
+            if is_label(code[start]):
+                self.crossing |= liveness.live_in[b]
+        self.definitions = {}
+        for line in code:
+            t = defines(line)
+            if t is not None:
+                self.definitions[t] = self.definitions.get(t, 0) + 1
+        self.demand = self.measure_demand(liveness)
+        # lines in loops, where loads of scalar cells are free once the cells are pinned
+        self.in_loop = [self.cfg.loop_of[b] >= 0 for b in self.cfg.block_of]
+        self.numbers = {}  # expression -> its number
+        self.expressions = []  # number -> its expression, operands by their numbers
+        self.costs = {}
+        self.unique = 0
+        self.changes = 0
+
+    def measure_demand(self, liveness):  # registers every line needs, the temporaries living through included
+        demand = [0] * len(self.code)
+        for b, (start, end) in enumerate(self.blocks):
+            live = set(liveness.live_out[b])
+            for i in reversed(range(start, end)):
+                line = self.code[i]
+                used = set(uses(line))
+                t = defines(line)
+                keyword = line[0]
+                if keyword == '/' or keyword == '%':
+                    need = 5
+                elif keyword == '*' or keyword == 'IF':
+                    need = 3
+                elif keyword == 'INC' or keyword == 'DEC' or keyword == 'READ' or keyword == 'WRITE':
+                    need = 1
+                else:
+                    need = 2
+                if t is not None or keyword == 'IF':
+                    need += len(used & live)  # operands still needed are copied before being changed
+                demand[i] = len(live - used - {t}) + need
+                live.discard(t)
+                live |= used
+        return demand
+
+    def run(self):
+        entry = self.solve()
+        code = self.code
+        result = []
+        extra = [0] * len(code)  # temporaries kept alive over a line for a value found again
+        last_use = {}
+        renamed = {}
+        state = Numbering()
+        for b, (start, end) in enumerate(self.blocks):
+            if b == 0 or is_label(code[start]) or code[start - 1][0] != 'IF':
+                state = Numbering(entry[b])
+            for i in range(start, end):
+                line = self.rename(code[i], renamed)
+                for u in uses(line):
+                    last_use[u] = i
+                keyword = line[0]
+                t = defines(line)
+                if keyword == 'LOAD' or keyword in ARITHMETIC:
+                    if keyword == 'LOAD':
+                        value = self.content(state, line[1])
+                        saving = 0 if self.in_loop[i] and is_scalar_cell(self.tables, line[1]) else 20
+                    else:
+                        value = self.number(state, keyword, line[1], line[2])
+                        saving = self.cost(value, self.in_loop[i])
+                    h = state.holders.get(value)
+                    if h is not None and saving >= 20 and self.definitions[t] == 1 and t not in self.crossing:
+                        span = range(last_use[h], i)
+                        if all(self.demand[j] + extra[j] < 6 for j in span):
+                            for j in span:
+                                extra[j] += 1
+                            renamed[t] = h
+                            last_use[h] = i
+                            self.changes += 1
+                            continue
+                    cell = state.cells.get(value)
+                    if keyword in ('*', '/', '%') and cell is not None \
+                            and state.generation.get(cell[0], 0) == cell[1] \
+                            and self.cost(value, False) > address_cost(cell[0]):
+                        line = ['LOAD', cell[0], t]
+                        self.changes += 1
+                    if self.definitions[t] == 1:
+                        state.values[t] = value
+                        state.holders[value] = t
+                        last_use[t] = i
+                    else:
+                        state.values[t] = self.new_number()
+                else:
+                    self.transfer(state, line)
+                result.append(line)
+        return self.remove_unused(result)
+
+    def solve(self):  # scalar cells holding known values on entry to every block
+        entry = [None] * len(self.blocks)
+        if self.blocks:
+            entry[0] = {}
+        changed = True
+        while changed:
+            changed = False
+            for b in self.cfg.order:
+                if entry[b] is None:
+                    continue
+                start, end = self.blocks[b]
+                state = Numbering(entry[b])
+                for i in range(start, end):
+                    self.transfer(state, self.code[i])
+                out = self.facts(state)
+                for s in self.cfg.succ[b]:
+                    if entry[s] is None:
+                        entry[s] = out
+                        changed = True
+                    else:
+                        meet = {k: v for k, v in entry[s].items() if out.get(k) == v}
+                        if len(meet) != len(entry[s]):
+                            entry[s] = meet
+                            changed = True
+        return entry
+
+    def transfer(self, state, line):
+        keyword = line[0]
+        t = defines(line)
+        if keyword == 'LOAD':
+            state.values[t] = self.content(state, line[1])
+        elif keyword in ARITHMETIC:
+            state.values[t] = self.number(state, keyword, line[1], line[2])
+        elif keyword == 'INC' or keyword == 'DEC':
+            state.values[t] = self.new_number()
+        elif keyword == 'STORE':
+            self.write(state, line[2], self.value(state, line[1]))
+        elif keyword == 'ASSIGN':
+            self.write(state, self.symbol_table[line[2]]['address'], self.value(state, line[1]))
+        elif keyword == 'READ':
+            self.write(state, line[1], None)
+
+    def facts(self, state):  # scalar cells holding values made of scalar cells that have not changed since
+        rebased = {}  # number -> number of the same value counting writes from the block end, None if unknown
+
+        def rebase(value):
+            if value not in rebased:
+                e = self.expressions[value]
+                if e[0] == 'c':
+                    rebased[value] = value
+                elif e[0] == 'cell':
+                    rebased[value] = self.intern(('cell', e[1], 0)) \
+                        if state.generation.get(e[1], 0) == e[2] else None
+                elif e[0] in ARITHMETIC:
+                    a = rebase(e[1])
+                    b = rebase(e[2])
+                    rebased[value] = None if a is None or b is None else self.intern((e[0], a, b))
+                else:
+                    rebased[value] = None
+            return rebased[value]
+        facts = {}
+        for key, value in state.memory.items():
+            if key[0] == 'cell' and state.generation.get(key[1], 0) == key[2] and rebase(value) is not None:
+                facts[key[1]] = rebased[value]
+        return facts
+
+    def intern(self, expression):
+        if expression not in self.numbers:
+            self.numbers[expression] = len(self.expressions)
+            self.expressions.append(expression)
+        return self.numbers[expression]
+
+    def value(self, state, arg):
+        if is_temp(arg):
+            if arg not in state.values:
+                state.values[arg] = self.new_number()
+            return state.values[arg]
+        return self.intern(('c', arg))
+
+    def number(self, state, op, a, b):
+        a = self.value(state, a)
+        b = self.value(state, b)
+        if (op == '+' or op == '*') and b < a:
+            a, b = b, a
+        return self.intern((op, a, b))
+
+    def cell(self, state, address):  # key of the content of the cell at a constant or computed address
+        if is_temp(address):
+            value = self.value(state, address)
+            table = self.address_tables.get(address)
+            if table is not None and self.table_numbers.setdefault(value, table) != table:
+                self.table_numbers[value] = None  # equal addresses built for two tables
+            return 'at', value
+        if not is_scalar_cell(self.tables, address):
+            return 'at', self.intern(('c', address))
+        return 'cell', address, state.generation.get(address, 0)
+
+    def content(self, state, address):
+        key = self.cell(state, address)
+        if key not in state.memory:
+            state.memory[key] = self.intern(key) if key[0] == 'cell' else self.new_number()
+        return state.memory[key]
+
+    def write(self, state, address, value):  # value None for one nobody knows
+        key = self.cell(state, address)
+        if key[0] == 'at':
+            for other in [k for k in state.memory if k[0] == 'at' and self.may_alias(k[1], key[1])]:
+                del state.memory[other]
+        else:
+            state.generation[address] = key[2] + 1
+            key = self.cell(state, address)
+        if value is not None:
+            state.memory[key] = value
+            if key[0] == 'cell':
+                state.cells[value] = (address, key[2])
+
+    def may_alias(self, a, b):  # numbers of two table addresses
+        if a == b:
+            return True
+        ta = self.table_of(a)
+        tb = self.table_of(b)
+        if ta is not None and tb is not None and ta != tb:
+            return False
+        a = self.expressions[a]
+        b = self.expressions[b]
+        if a[0] == 'c' and b[0] == 'c':
+            return False
+        da = self.displacement(a)
+        db = self.displacement(b)
+        return da is None or db is None or da[1] != db[1] or da[0] == db[0]
+
+    def displacement(self, address):  # (constant, index) of an address made of both
+        if address[0] == '+' or address[0] == '-':
+            a = self.expressions[address[1]]
+            b = self.expressions[address[2]]
+            if b[0] == 'c':
+                return b[1] if address[0] == '+' else -b[1], address[1]
+            if a[0] == 'c' and address[0] == '+':
+                return a[1], address[2]
+        return None
+
+    def table_of(self, value):
+        # the table a numbered address falls in, if known: a computed one only by what the analyzer
+        # built it for, as after unrolling the constant in it may be the base of another table
+        e = self.expressions[value]
+        if e[0] == 'c':
+            return table_at(self.tables, e[1])
+        return self.table_numbers.get(value)
+
+    def cost(self, value, in_loop):  # rough cost of computing a value again, capped
+        if (value, in_loop) in self.costs:
+            return self.costs[(value, in_loop)]
+        e = self.expressions[value]
+        kind = e[0]
+        if kind == 'c':
+            cost = 0
+        elif kind == 'cell':
+            cost = 0 if in_loop else 20
+        elif kind in ARITHMETIC:
+            a = self.expressions[e[1]]
+            b = self.expressions[e[2]]
+            if kind == '+' or kind == '-':
+                cost = 5
+            elif kind == '*' and (a[0] == 'c' or b[0] == 'c'):
+                cost = 3 * (a[1] if a[0] == 'c' else b[1]).bit_length()
+            elif kind != '*' and b[0] == 'c' and b[1] & (b[1] - 1) == 0:
+                cost = 3 * b[1].bit_length()
+            else:
+                cost = 50
+            cost = min(cost + self.cost(e[1], in_loop) + self.cost(e[2], in_loop), 1000)
+        else:
+            cost = 20  # a load from a table or a value changed in place
+        self.costs[(value, in_loop)] = cost
+        return cost
+
+    def new_number(self):
+        self.unique += 1
+        return self.intern(('unique', self.unique))
+
+    def rename(self, line, renamed):
+        def name(a):
+            return renamed.get(a, a) if is_temp(a) else a
+        if line[0] == 'IF':
+            a, op, b = line[1]
+            return ['IF', [name(a), op, name(b)], line[2], line[3]]
+        if line[0] == 'INC' or line[0] == 'DEC':
+            return line
+        t = defines(line)
+        line = [name(a) for a in line]
+        if t is not None:
+            line[-1] = t
+        return line
+
+    def remove_unused(self, code):  # lines computing temporaries nothing uses any more
+        while True:
+            used = set()
+            for line in code:
+                used.update(uses(line))
+            kept = [line for line in code if line[0] != 'LOAD' and line[0] not in ARITHMETIC or defines(line) in used]
+            if len(kept) == len(code):
+                return code
+            code = kept
+
+
+class LoopInvariantCodeMotion:
+    # Computations whose operands do not change inside a loop are done once in front of it. Temps
+    # do not live across labels, so every hoisted value gets a memory cell of its own: it is stored
+    # there in front of the loop head and its definition in the loop becomes a load of that cell,
+    # which the register allocator can keep in a register. Outer loops are handled first, so a value
+    # invariant in several nested loops moves out of all of them at once. Nothing is rewritten, so
+    # the saturating arithmetic gives the same results; the cells of iterators count as written in
+    # their own loop only, by its step.
+    def __init__(self, code, analyzer):
+        self.code = code
+        self.analyzer = analyzer
+        self.tables = table_ranges(analyzer.symbol_table)
+        self.shared = set().union(*Liveness(code).live_out)
+        self.hoisted = {}  # loop head label -> number of lines moved out of the loop
+        self.changes = 0
+
+    def run(self):
+        code = self.code
+        cfg = ControlFlowGraph(code)
+        sources = {}  # label -> lines jumping to it
+        for i, line in enumerate(code):
+            if is_jump(line):
+                sources.setdefault(jump_target(line), []).append(i)
+        # the loops with one entry, outer ones first; hoisting keeps every label and jump, so the
+        # loops stay the same and only their lines move
+        pending = [(head, end) for head, end in sorted(filter(None, map(cfg.lines, cfg.loops)))
+                   if all(head <= i <= end for i in sources[code[head][0]])]
+        for k, (head, end) in enumerate(pending):
+            hoisted, placed = self.hoist(code, head, end)
+            if hoisted is not code:
+                shift = len(hoisted) - len(code)
+                pending[k + 1:] = [(placed[h], placed[e]) if h <= end else (h + shift, e + shift)
+                                   for h, e in pending[k + 1:]]
+                code = hoisted
+        return code
+
+    def hoist(self, code, head, end):
+        written = set()
+        tables_written = False
+        definitions = {}
+        for i in range(head, end + 1):
+            line = code[i]
+            address = None
+            if line[0] == 'STORE':
+                address = line[2]
+            elif line[0] == 'READ':
+                address = line[1]
+            elif line[0] == 'ASSIGN':
+                address = self.analyzer.symbol_table[line[2]]['address']
+            if address is not None:
+                if not is_scalar_cell(self.tables, address):
+                    tables_written = True
+                else:
+                    written.add(address)
+            t = defines(line)
+            if t is not None:
+                definitions[t] = definitions.get(t, 0) + 1
+        invariant = {}  # temp -> index of its definition
+        for i in range(head, end + 1):
+            line = code[i]
+            t = defines(line)
+            if t is None or definitions[t] > 1 or t in self.shared or line[0] == 'INC' or line[0] == 'DEC':
+                continue
+            if line[0] == 'LOAD':
+                address = line[1]
+                if is_temp(address):
+                    ok = address in invariant and not tables_written
+                else:
+                    ok = address not in written and (not tables_written or is_scalar_cell(self.tables, address))
+            else:
+                ok = all(not is_temp(a) or a in invariant for a in line[1:3])
+            if ok:
+                invariant[t] = i
+        roots = set()
+        for i in range(head, end + 1):
+            line = code[i]
+            if defines(line) not in invariant:
+                roots.update(t for t in uses(line) if t in invariant)
+        cell = self.analyzer.next_address_pointer
+        hoisted = {t for t in roots if code[invariant[t]][0] != 'LOAD' or is_temp(code[invariant[t]][1])}
+        hoisted = {t for t in hoisted if self.tree_cost(code, invariant, t) > address_cost(cell)}
+        if not hoisted:
+            return code, None
+        renamed = {}
+        preheader = []
+        exit_ = []
+        if code[end][0] == 'GOTO':
+            # a FOR loop tested at its top may not run at all, the loop test is then repeated in
+            # front of the hoisted lines so that they run only if the body does; lines with effects
+            # in front of the first jump mean the loop is tested further down, behind a test of its own
+            i = head + 1
+            while not is_label(code[i]) and not is_jump(code[i]):
+                i += 1
+            if code[i][0] == 'IF' and all(defines(line) is not None for line in code[head + 1:i]):
+                if not is_label(code[end + 1]) or jump_target(code[i]) != code[end + 1][0]:
+                    return code, None
+                skip = self.analyzer.get_label()
+                preheader = [self.copy(line, renamed) for line in code[head + 1:i + 1]]
+                preheader[-1][-1] = skip + ':F'
+                exit_ = [[skip]]
+        moved = set()
+        for t in hoisted:
+            self.collect(code, invariant, t, moved)
+        needed = set()  # lines still computing the roots that stay in the loop
+        for t in roots - hoisted:
+            self.collect(code, invariant, t, needed, hoisted)
+        cells = {}
+        for i in sorted(moved):
+            preheader.append(self.copy(code[i], renamed))
+            t = defines(code[i])
+            if t in hoisted:
+                cells[t] = self.analyzer.next_address_pointer
+                self.analyzer.next_address_pointer += 1
+                preheader.append(['STORE', renamed[t], cells[t]])
+        body = []
+        placed = {}  # line of the loop -> where it is now, for those kept as they are
+        for i in range(head, end + 1):
+            t = defines(code[i])
+            if t in cells:
+                body.append(['LOAD', cells[t], t])
+            elif i not in moved or i in needed:
+                placed[i] = head + len(preheader) + len(body)
+                body.append(code[i])
+        self.hoisted[code[head][0]] = len(moved)
+        self.changes += len(moved)
+        return code[:head] + preheader + body + code[end + 1:end + 2] + exit_ + code[end + 2:], placed
+
+    def copy(self, line, renamed):  # the line with its temps renamed, a new name for the one it defines
+        def name(a):
+            return renamed.get(a, a) if is_temp(a) else a
+        if line[0] == 'IF':
+            a, op, b = line[1]
+            return ['IF', [name(a), op, name(b)], line[2], line[3]]
+        t = defines(line)
+        line = [name(a) for a in line]
+        if t is not None:
+            renamed[t] = self.analyzer.get_temp_var()
+            line[-1] = renamed[t]
+        return line
+
+    def collect(self, code, invariant, t, lines, stop=()):  # indices of the lines computing t
+        i = invariant[t]
+        if i not in lines:
+            lines.add(i)
+            for a in uses(code[i]):
+                if a not in stop:
+                    self.collect(code, invariant, a, lines, stop)
+
+    def tree_cost(self, code, invariant, t):  # rough cost of computing t inside the loop
+        line = code[invariant[t]]
+        if line[0] == 'LOAD':
+            if not is_temp(line[1]):
+                return address_cost(line[1])
+            return 20 + self.tree_cost(code, invariant, line[1])
+        cost = 5 if line[0] == '+' or line[0] == '-' else 50
+        for a in line[1:3]:
+            cost += self.tree_cost(code, invariant, a) if is_temp(a) else derivation(0, a)[0] + 1
+        return cost
+
+
+PASSES = [  # every pass by its name, in the order they run in a round
+    ('partial-evaluation', PartialEvaluation),
+    ('constant-propagation', ConstantPropagation),
+    ('sccp', SparseConditionalConstantPropagation),
+    ('copy-propagation', CopyPropagation),
+    ('dead-code', DeadCodeElimination),
+    ('value-numbering', ValueNumbering),
+    ('licm', LoopInvariantCodeMotion),
+]
+
+
+class CompilerOptimizer:
+    # Runs the enabled passes in the order of PASSES, round after round, until a round changes
+    # nothing or max_rounds rounds have run. The time every pass took and the changes it made are
+    # summed up by its name, and every run of a pass is logged with the length of the code around it.
+    def __init__(self, analyzer, passes=None, max_rounds=10):
+        self.analyzer = analyzer
+        self.passes = [(name, optimization) for name, optimization in PASSES if passes is None or name in passes]
+        self.max_rounds = max_rounds
+        self.times = {name: 0.0 for name, _ in self.passes}
+        self.hits = {name: 0 for name, _ in self.passes}
+        self.rounds = 0
+        self.log = []  # (round, pass, lines before, lines after, changes, seconds) per run of a pass
+        self.hoisted = {}  # loop head label -> lines moved out of the loop
+
+    def optimize(self):
+        code = self.analyzer.intermediate_code
+        while self.rounds < self.max_rounds:
+            self.rounds += 1
+            changes = 0
+            for name, optimization in self.passes:
+                start = time.perf_counter()
+                before = len(code)
+                current = optimization(code, self.analyzer)
+                code = current.run()
+                elapsed = time.perf_counter() - start
+                self.times[name] += elapsed
+                self.hits[name] += current.changes
+                self.log.append((self.rounds, name, before, len(code), current.changes, elapsed))
+                changes += current.changes
+                for label, count in getattr(current, 'hoisted', {}).items():
+                    self.hoisted[label] = self.hoisted.get(label, 0) + count
+            if not changes:
+                break
+        self.analyzer.intermediate_code = code
+        return code
@@ -0,0 +1,84 @@
+import contextlib
+import json
+import time
+import tracemalloc
+
+
+class CompileProfile:
+    # Wall time and peak traced memory of every phase of a compilation, the length of the
+    # intermediate code around every run of an optimization pass, the hits of the passes and of the
+    # peephole rules, the lines hoisted out of every loop and the length of the target code, as a
+    # table or as JSON. Tracing memory slows
+    # the compiler down several times, so a profile takes two compilations of the same source: the
+    # times come from the first one and the peaks from the second, made with trace_memory set.
+    def __init__(self):
+        self.trace_memory = False
+        self.phases = {}  # phase -> [seconds, peak bytes]
+        self.intermediate_lines = {}  # point of the compilation -> length of the intermediate code
+        self.passes = []  # (round, pass, lines before, lines after, changes, seconds)
+        self.pass_hits = {}
+        self.hoisted = {}  # loop head label -> lines moved out of the loop
+        self.peephole_hits = {}
+        self.target_instructions = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        measured = self.phases.setdefault(name, [0.0, 0])
+        if not self.trace_memory:
+            start = time.perf_counter()
+            yield
+            measured[0] = time.perf_counter() - start
+            return
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            measured[1] = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+
+    def record_optimizer(self, optimizer):
+        if not self.trace_memory:
+            self.passes = optimizer.log
+            self.pass_hits = optimizer.hits
+            self.hoisted = optimizer.hoisted
+
+    def as_dict(self):
+        return {
+            'phases': [{'name': name, 'seconds': seconds, 'peak_bytes': peak}
+                       for name, (seconds, peak) in self.phases.items()],
+            'total_seconds': sum(seconds for seconds, _ in self.phases.values()),
+            'intermediate_lines': self.intermediate_lines,
+            'passes': [{'round': r, 'name': name, 'lines_before': before, 'lines_after': after, 'changes': changes,
+                        'seconds': seconds} for r, name, before, after, changes, seconds in self.passes],
+            'pass_hits': self.pass_hits,
+            'hoisted': self.hoisted,
+            'peephole_hits': self.peephole_hits,
+            'target_instructions': self.target_instructions,
+        }
+
+    def json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def table(self):
+        lines = [f"{'phase':<20} {'seconds':>10} {'peak KB':>10}"]
+        for name, (seconds, peak) in self.phases.items():
+            lines.append(f'{name:<20} {seconds:>10.4f} {peak / 1024:>10.0f}')
+        lines.append(f"{'total':<20} {sum(seconds for seconds, _ in self.phases.values()):>10.4f}")
+        if self.passes:
+            lines += ['', f"{'round':>5} {'pass':<20} {'before':>8} {'after':>8} {'changes':>8} {'seconds':>10}"]
+            for r, name, before, after, changes, seconds in self.passes:
+                lines.append(f'{r:>5} {name:<20} {before:>8} {after:>8} {changes:>8} {seconds:>10.4f}')
+        lines.append('')
+        for point, count in self.intermediate_lines.items():
+            lines.append(f"{'intermediate lines ' + point:<31} {count:>8}")
+        lines.append(f"{'target instructions':<31} {self.target_instructions:>8}")
+        for title, column, hits in (('pass', 'hits', self.pass_hits), ('loop head', 'hoisted', self.hoisted),
+                                    ('peephole rule', 'hits', self.peephole_hits)):
+            if hits:
+                lines += ['', f"{title:<20} {column:>10}"]
+                lines += [f'{name:<20} {count:>10}' for name, count in hits.items()]
+        return '\n'.join(lines)
@@ -0,0 +1,128 @@
+from compiler_ir import ScalarLiveness
+
+
+class SSAForm:
+    # Static single assignment form of the scalar memory cells (variables and iterators, at constant
+    # addresses outside of tables) over the control flow graph. Every STORE, ASSIGN or READ of such
+    # a cell makes a new version of it, every LOAD or WRITE of it reads the one version reaching it,
+    # and phi nodes at the iterated dominance frontiers of the definitions join the versions coming
+    # from different predecessors. Versions are numbers kept beside the lines, the code itself is not
+    # rewritten: every version lives in the cell it is a version of, so leaving SSA is free and two
+    # versions may share a cell wherever one is not overwritten while the other is still read.
+    # Tables stay in memory as they are, and temporaries, which never outlive a label, need no
+    # renaming. Blocks no path reaches get no versions.
+    def __init__(self, code, symbol_table, cfg):
+        self.code = code
+        self.cfg = cfg
+        self.cells = ScalarLiveness(code, symbol_table)
+        self.cell_of = []  # version -> its cell
+        self.origin = []  # version -> line defining it, ~block for a phi, None for the value on entry
+        self.entry = {}  # cell -> its version on entry to the program
+        self.read = {}  # line -> version it reads
+        self.written = {}  # line -> version it defines
+        self.phis = [{} for _ in cfg.blocks]  # block -> cell -> version its phi defines
+        self.args = {}  # version of a phi -> (predecessor, version coming from it) pairs
+        self.children = [[] for _ in cfg.blocks]  # dominator tree
+        for b in cfg.order[1:]:
+            self.children[cfg.idom[b]].append(b)
+        self.place_phis()
+        self.rename()
+
+    def new_version(self, cell, origin):
+        self.cell_of.append(cell)
+        self.origin.append(origin)
+        return len(self.cell_of) - 1
+
+    def frontiers(self):  # blocks where the dominance of each block ends
+        cfg = self.cfg
+        frontier = [set() for _ in cfg.blocks]
+        for b in cfg.order:
+            preds = [p for p in cfg.pred[b] if cfg.idom[p] >= 0]
+            if len(preds) < 2:
+                continue
+            for p in preds:
+                while p != cfg.idom[b]:
+                    frontier[p].add(b)
+                    p = cfg.idom[p]
+        return frontier
+
+    def place_phis(self):
+        frontier = self.frontiers()
+        sites = {}  # cell -> blocks defining it
+        for b in self.cfg.order:
+            start, end = self.cfg.blocks[b]
+            for i in range(start, end):
+                cell = self.cells.cell_defined(self.code[i])
+                if cell is not None:
+                    sites.setdefault(cell, set()).add(b)
+        for cell, blocks in sites.items():
+            pending = list(blocks)
+            while pending:
+                for f in frontier[pending.pop()]:
+                    if cell not in self.phis[f]:
+                        self.phis[f][cell] = self.new_version(cell, ~f)
+                        self.args[self.phis[f][cell]] = []
+                        if f not in blocks:
+                            pending.append(f)
+
+    def walk(self, visit, leave=None):
+        # walks the dominator tree calling visit(i, current) in front of every line i, where
+        # current(cell) is the version of the cell reaching that line, and leave(b, current) at the
+        # end of every block b
+        stacks = {}
+
+        def current(cell):
+            stack = stacks.get(cell)
+            if stack:
+                return stack[-1]
+            if cell not in self.entry:
+                self.entry[cell] = self.new_version(cell, None)
+            return self.entry[cell]
+
+        pending = [0] if self.cfg.order else []
+        while pending:
+            b = pending.pop()
+            leaving = b < 0
+            start, end = self.cfg.blocks[~b if leaving else b]
+            if leaving:
+                for i in range(start, end):
+                    if i in self.written:
+                        stacks[self.cell_of[self.written[i]]].pop()
+                for cell in self.phis[~b]:
+                    stacks[cell].pop()
+                continue
+            for cell, v in self.phis[b].items():
+                stacks.setdefault(cell, []).append(v)
+            for i in range(start, end):
+                visit(i, current)
+                if i in self.written:
+                    stacks.setdefault(self.cell_of[self.written[i]], []).append(self.written[i])
+            if leave is not None:
+                leave(b, current)
+            pending.append(~b)
+            pending.extend(self.children[b])
+
+    def rename(self):
+        def visit(i, current):
+            line = self.code[i]
+            for cell in self.cells.cell_uses(line):
+                self.read[i] = current(cell)
+            cell = self.cells.cell_defined(line)
+            if cell is not None:
+                self.written[i] = self.new_version(cell, i)
+
+        def leave(b, current):
+            for s in self.cfg.succ[b]:
+                for cell, v in self.phis[s].items():
+                    self.args[v].append((b, current(cell)))
+        self.walk(visit, leave)
+
+    def versions_at(self, queries):
+        # queries maps lines to cells, returns the version of each such cell reaching its line
+        found = {}
+
+        def visit(i, current):
+            if i in queries:
+                found[i] = current(queries[i])
+        self.walk(visit)
+        return found
@@ -0,0 +1,192 @@
+WRITES_ONLY = ('RESET', 'LOAD')  # ops writing their first register without reading it (LOAD a a excepted)
+UPDATES = ('LOAD', 'ADD', 'SUB', 'RESET', 'INC', 'DEC', 'SHL', 'SHR')  # ops changing only their first register
+JUMPS = ('JUMP', 'JZERO', 'JODD')
+WINDOW = 8
+
+
+def parse(line):
+    if not line[0].isupper():
+        return ('LABEL', line)
+    s = line.split(' ')
+    if s[0] in JUMPS:
+        s[-1] = tuple(s[-1].split(':'))
+    return tuple(s)
+
+
+def unparse(instr):
+    if instr[0] == 'LABEL':
+        return instr[1]
+    if instr[0] in JUMPS:
+        return ' '.join(instr[:-1] + (':'.join(instr[-1]),))
+    return ' '.join(instr)
+
+
+def reads(instr, reg):
+    op = instr[0]
+    if op == 'RESET' or op == 'JUMP' or op == 'HALT' or op == 'LABEL':
+        return False
+    if op == 'LOAD':
+        return instr[2] == reg
+    return reg in instr[1:3]
+
+
+def overwrites(instr, reg):  # sets reg without depending on its old value
+    return instr[0] in WRITES_ONLY and instr[1] == reg and not (instr[0] == 'LOAD' and instr[2] == reg)
+
+
+class PeepholeOptimizer:
+    # Rewrites the unlinked target code with a table of local rules until none of them applies.
+    # A rule gets a window of the next instructions starting with one of its opcodes and returns how
+    # many of them it consumed together with their replacement, or None if it does not match.
+    # After a rewrite the instructions just before it are looked at again, so chains of matches
+    # settle within one pass. Another pass is made only if jumps or labels have changed.
+    def __init__(self, max_passes=20):
+        self.max_passes = max_passes
+        self.rules = [
+            ('unreachable', ('JUMP', 'HALT'), self.unreachable),
+            ('jump_to_next', JUMPS, self.jump_to_next),
+            ('jump_threading', JUMPS, self.jump_threading),
+            ('unused_label', ('LABEL',), self.unused_label),
+            ('store_load', ('STORE',), self.store_load),
+            ('load_store', ('LOAD',), self.load_store),
+            ('double_store', ('STORE',), self.double_store),
+            ('inc_dec', ('INC', 'SHL'), self.inc_dec),
+            ('dead_write', UPDATES, self.dead_write),
+        ]
+        self.hits = {name: 0 for name, ops, rule in self.rules}
+        self.passes = 0
+
+    def optimize(self, target_code):
+        code = [parse(line) for line in target_code]
+        by_op = {}
+        for name, ops, rule in self.rules:
+            for op in ops:
+                by_op.setdefault(op, []).append((name, rule))
+        self.prepare(code)
+        for _ in range(self.max_passes):
+            self.passes += 1
+            rest = code[::-1]  # instructions still to look at, the next one last
+            out = []
+            changed = False
+            while rest:
+                rules = by_op.get(rest[-1][0])
+                if rules:
+                    window = rest[:-WINDOW - 2:-1]
+                    for name, rule in rules:
+                        match = rule(window)
+                        if match is not None:
+                            consumed, replacement = match
+                            self.hits[name] += 1
+                            changed = True
+                            del rest[len(rest) - consumed:]
+                            rest.extend(reversed(replacement))
+                            back = out[-WINDOW:]
+                            del out[-WINDOW:]
+                            rest.extend(reversed(back))
+                            break
+                    else:
+                        out.append(rest.pop())
+                else:
+                    out.append(rest.pop())
+            code = out
+            labels = (self.referenced, self.first_after)
+            self.prepare(code)
+            if not changed or labels == (self.referenced, self.first_after):
+                break
+        return [unparse(instr) for instr in code]
+
+    def prepare(self, code):
+        self.referenced = set()
+        self.first_after = {}  # label -> first instruction following it
+        pending = []
+        for instr in code:
+            if instr[0] == 'LABEL':
+                pending.append(instr[1])
+                continue
+            if instr[0] in JUMPS:
+                self.referenced.add(instr[-1][0])
+            for label in pending:
+                self.first_after[label] = instr
+            pending = []
+
+    # ------------------------------------------ rules -----------------------------------------------
+
+    def unreachable(self, window):  # nothing after a JUMP or HALT runs until the next label
+        j = 1
+        while j < len(window) and window[j][0] != 'LABEL':
+            j += 1
+        if j == 1:
+            return None
+        return j, [window[0]]
+
+    def jump_to_next(self, window):
+        target = window[0][-1][0]
+        j = 1
+        while j < len(window) and window[j][0] == 'LABEL':
+            if window[j][1] == target:
+                return 1, []
+            j += 1
+        return None
+
+    def jump_threading(self, window):  # a jump to an unconditional jump goes straight to its target
+        instr = window[0]
+        target = instr[-1][0]
+        seen = {target}
+        next_instr = self.first_after.get(target)
+        while next_instr is not None and next_instr[0] == 'JUMP':
+            target = next_instr[1][0]
+            if target in seen:  # endless loop, leave it alone
+                return None
+            seen.add(target)
+            next_instr = self.first_after.get(target)
+        if target == instr[-1][0]:
+            return None
+        self.referenced.add(target)
+        return 1, [instr[:-1] + ((target, instr[-1][1]),)]
+
+    def unused_label(self, window):
+        if window[0][1] in self.referenced:
+            return None
+        return 1, []
+
+    def store_load(self, window):  # STORE a x; LOAD b x -> the value is still in a
+        if len(window) < 2:
+            return None
+        store, load = window[0], window[1]
+        if load[0] != 'LOAD' or load[2] != store[2]:
+            return None
+        if load[1] == store[1]:
+            return 2, [store]
+        return 2, [store, ('RESET', load[1]), ('ADD', load[1], store[1])]
+
+    def load_store(self, window):  # LOAD a x; STORE a x writes back what is already there
+        if len(window) < 2:
+            return None
+        load, store = window[0], window[1]
+        if store[0] != 'STORE' or store[1:] != load[1:] or load[1] == load[2]:
+            return None
+        return 2, [load]
+
+    def double_store(self, window):
+        if len(window) < 2 or window[1][0] != 'STORE' or window[1][2] != window[0][2]:
+            return None
+        return 1, []
+
+    def inc_dec(self, window):  # INC r; DEC r and SHL r; SHR r cancel out
+        if len(window) < 2:
+            return None
+        first, second = window[0], window[1]
+        if second[1:] != first[1:] or (first[0], second[0]) not in (('INC', 'DEC'), ('SHL', 'SHR')):
+            return None
+        return 2, []
+
+    def dead_write(self, window):  # the register is overwritten before anything reads it
+        reg = window[0][1]
+        for instr in window[1:]:
+            if instr[0] == 'HALT':
+                return 1, []
+            if instr[0] == 'LABEL' or instr[0] in JUMPS or reads(instr, reg):
+                return None
+            if overwrites(instr, reg):
+                return 1, []
+        return None
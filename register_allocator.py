@@ -0,0 +1,98 @@
+import bisect
+
+from compiler_cfg import ControlFlowGraph
+from compiler_ir import ScalarLiveness, is_jump, is_label, jump_target
+
+REGISTERS = 'abcdef'
+
+
+class Loop:
+    def __init__(self, head, end):
+        self.head = head
+        self.end = end
+        self.children = []
+
+
+class RegisterAllocator:
+    # Keeps the most used scalar memory cells of every loop in registers the loop body does not
+    # need for temporaries. Outer loops are served first, inner loops get what is left.
+    # Pinned cells are loaded in front of the loop head and stored back on the loop exit
+    # only if the loop changes them and they are still live there.
+    def __init__(self, code, symbol_table, pressure):
+        self.code = code
+        self.pressure = pressure
+        self.cells = ScalarLiveness(code, symbol_table)
+        self.entry = {}
+        self.exit_before = {}
+        self.exit_after = {}
+        labels = {line[0]: i for i, line in enumerate(code) if is_label(line)}
+        self.jumps_by_source = [(i, labels[jump_target(line)]) for i, line in enumerate(code) if is_jump(line)]
+        self.jumps_by_target = sorted((target, source) for source, target in self.jumps_by_source)
+        self.cfg = ControlFlowGraph(code)
+        roots = []
+        for natural in self.cfg.loops:
+            if natural.parent is None:
+                self.nest(natural, roots)
+        for loop in roots:
+            self.allocate(loop, [])
+
+    def nest(self, natural, siblings):
+        # the loops of the control flow graph that can keep registers, under the closest such loop
+        # around them
+        lines = self.cfg.lines(natural)
+        if lines is not None and self.is_single_entry_exit(*lines):
+            loop = Loop(*lines)
+            siblings.append(loop)
+            siblings = loop.children
+        for inner in natural.children:
+            self.nest(inner, siblings)
+
+    def depth(self, i):  # number of loops line i is in
+        return self.cfg.depth(self.cfg.block_of[i])
+
+    def is_single_entry_exit(self, head, end):
+        falls_out = self.code[end][0] == 'IF'
+        if not falls_out and not is_label(self.code[end + 1]):
+            return False
+        first = bisect.bisect_left(self.jumps_by_source, (head, -1))
+        for source, target in self.jumps_by_source[first:]:
+            if source > end:
+                break
+            if target == end + 1 and falls_out or not head <= target <= end + 1:
+                return False
+        first = bisect.bisect_left(self.jumps_by_target, (head, -1))
+        for target, source in self.jumps_by_target[first:]:
+            if target > end + 1 or target == end + 1 and falls_out:
+                break
+            if not head <= source <= end:
+                return False
+        return True
+
+    def allocate(self, loop, outer_pins):
+        base = self.depth(loop.head)
+        scores = {}
+        written = set()
+        for i in range(loop.head, loop.end + 1):
+            weight = 10 ** min(self.depth(i) - base, 6)
+            line = self.code[i]
+            for address in self.cells.cell_uses(line):
+                scores[address] = scores.get(address, 0) + weight
+            address = self.cells.cell_defined(line)
+            if address is not None:
+                scores[address] = scores.get(address, 0) + weight
+                written.add(address)
+        taken = {address for address, reg in outer_pins}
+        candidates = sorted((a for a in scores if a not in taken), key=lambda a: (-scores[a], a))
+        free = [r for r in reversed(REGISTERS) if r not in {reg for address, reg in outer_pins}]
+        count = len(REGISTERS) - len(outer_pins) - max(1, max(self.pressure[loop.head:loop.end + 1]))
+        pins = list(zip(candidates, free))[:max(count, 0)]
+        live_in = self.cells.live_at(loop.head)
+        live_out = self.cells.live_at(loop.end + 1)
+        self.entry[loop.head] = [(address, reg, address in live_in) for address, reg in pins]
+        exits = [(address, reg, address in written and address in live_out) for address, reg in pins]
+        if self.code[loop.end][0] == 'IF':
+            self.exit_before[loop.end + 1] = exits
+        else:
+            self.exit_after[loop.end + 1] = exits
+        for child in loop.children:
+            self.allocate(child, outer_pins + pins)
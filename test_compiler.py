@@ -0,0 +1,190 @@
+import os
+import zipfile
+
+import pytest
+
+from code_generator import shift_add_chain
+from compiler import LEVELS, compile_source
+from peephole import PeepholeOptimizer
+from vm import CompiledMachine, MachineError, VirtualMachine
+
+EXAMPLES = zipfile.ZipFile(os.path.join(os.path.dirname(__file__), 'Included', 'example_codes.zip'))
+EXAMPLE_INPUTS = {
+    '0-div-mod.imp': [[1, 0], [7, 3], [33, 5]],
+    '1-numbers.imp': [[5]],
+    '2-fib.imp': [[1]],
+    '3-fib-factorial.imp': [[20]],
+    '4-factorial.imp': [[20]],
+    '5-tab.imp': [[]],
+    '6-mod-mult.imp': [[1234567890, 1234567890987654321, 987654321]],
+    '7-loopiii.imp': [[0, 0, 0], [1, 0, 2]],
+    '8-for.imp': [[12, 23, 34]],
+    '9-sort.imp': [[]],
+    'program0.imp': [[13], [1000]],
+    'program1.imp': [[]],
+    'program2.imp': [[1234567], [2 ** 10 * 3 ** 5 * 7]],
+}
+
+
+def run(source, level, inputs=(), seed=0, max_steps=10 ** 6):
+    machine = VirtualMachine(compile_source(source, level), inputs, max_steps=max_steps, seed=seed)
+    return machine.run()
+
+
+@pytest.mark.parametrize('name', sorted(EXAMPLE_INPUTS))
+def test_example_gives_the_same_output_at_every_level(name):
+    source = EXAMPLES.read(name).decode()
+    for inputs in EXAMPLE_INPUTS[name]:
+        expected = run(source, '-O0', inputs)
+        assert expected
+        for level in LEVELS:
+            for seed in range(3):
+                assert run(source, level, inputs, seed) == expected, (level, inputs, seed)
+
+
+def outcome(machine):  # what a run shows: the outputs, cost, I/O cost and steps, or the error
+    try:
+        return machine.run(), machine.cost, machine.io_cost, machine.steps
+    except MachineError as e:
+        return str(e)
+
+
+@pytest.mark.parametrize('name', sorted(EXAMPLE_INPUTS))
+def test_compiled_machine_runs_like_the_virtual_machine(name):
+    source = EXAMPLES.read(name).decode()
+    for level in LEVELS:
+        code = compile_source(source, level)
+        for inputs in EXAMPLE_INPUTS[name]:
+            expected = outcome(VirtualMachine(code, inputs, max_steps=10 ** 6, seed=1))
+            assert outcome(CompiledMachine(code, inputs, max_steps=10 ** 6, seed=1)) == expected, (level, inputs)
+            steps = expected[3]
+            for max_steps in (steps, steps - 1):  # the last step allowed and the first one over the limit
+                expected = outcome(VirtualMachine(code, inputs, max_steps=max_steps, seed=1))
+                assert outcome(CompiledMachine(code, inputs, max_steps=max_steps, seed=1)) == expected, \
+                    (level, inputs, max_steps)
+            assert expected == f'VM: Step limit of {steps - 1} exceeded'
+
+
+# unrolled, q(i + 1) is at i + 6, and 6 is also the address - start of b
+TABLE_BASES = '''
+DECLARE
+    q(0:99), b(99:120), x, y
+BEGIN
+    FOR i FROM 0 TO 98 DO
+        x := q(5);
+        q(i) := 7;
+        y := q(5);
+        WRITE y;
+    ENDFOR
+END
+'''
+
+
+@pytest.mark.parametrize('level', LEVELS)
+def test_unrolled_table_address_is_not_taken_for_another_table(level):
+    assert run(TABLE_BASES, level) == [0] * 5 + [7] * 94
+
+
+ENDLESS_INNER_LOOP = '''
+DECLARE
+    a, k
+BEGIN
+    {}
+    FOR i FROM 1 TO {} DO
+        k := 1;
+        WHILE k > 0 DO
+            k := k + 1;
+        ENDWHILE
+    ENDFOR
+    WRITE a;
+END
+'''
+
+
+@pytest.mark.parametrize('level', LEVELS)
+@pytest.mark.parametrize('bounds', [('READ a;', 'a'), ('a := 3;', '3')])
+def test_loop_around_endless_loop_stays(level, bounds):
+    with pytest.raises(MachineError, match='Step limit'):
+        run(ENDLESS_INNER_LOOP.format(*bounds), level, [2], max_steps=10 ** 4)
+
+
+def test_shift_add_chain_gives_the_constant():
+    for c in range(1, 5000):
+        digits = shift_add_chain(c)
+        assert digits[0] == 1 and set(digits) <= {-1, 0, 1}, c
+        value = 0
+        for digit in digits:
+            value = 2 * value + digit
+        assert value == c
+
+
+def test_shift_add_chain_takes_the_cheaper_form():
+    assert shift_add_chain(10) == [1, 0, 1, 0]
+    assert shift_add_chain(15) == [1, 0, 0, 0, -1]
+    assert shift_add_chain(1000) == [1, 0, 0, 0, 0, -1, 0, 1, 0, 0, 0]
+
+
+BY_CONSTANT = '''
+DECLARE
+    a, b, c
+BEGIN
+    READ a;
+    b := a {0} {1};
+    c := {1} {0} a;
+    WRITE b;
+    WRITE c;
+END
+'''
+OPERANDS = [0, 1, 2, 7, 10, 1000, 123456789, 2 ** 40 + 3]
+
+
+@pytest.mark.parametrize('level', LEVELS)
+@pytest.mark.parametrize('c', [0, 1, 2, 8, 1024, 10, 1000, 15])
+def test_multiplication_by_constant(level, c):
+    code = compile_source(BY_CONSTANT.format('*', c), level)
+    assert not any(line.startswith('J') for line in code)  # no multiplication loop
+    for a in OPERANDS:
+        assert VirtualMachine(code, [a], seed=a).run() == [a * c, c * a], a
+
+
+def divide(a, b):  # division and modulo as the language defines them, 0 for a zero divisor
+    return (a // b, a % b) if b else (0, 0)
+
+
+@pytest.mark.parametrize('level', LEVELS)
+@pytest.mark.parametrize('c', [0, 1, 2, 8, 1024, 10, 15])
+def test_division_and_modulo_by_constant(level, c):
+    quotient = compile_source(BY_CONSTANT.format('/', c), level)
+    remainder = compile_source(BY_CONSTANT.format('%', c), level)
+    for a in OPERANDS:
+        assert VirtualMachine(quotient, [a], seed=a).run() == [divide(a, c)[0], divide(c, a)[0]], a
+        assert VirtualMachine(remainder, [a], seed=a).run() == [divide(a, c)[1], divide(c, a)[1]], a
+
+
+PEEPHOLE_REWRITES = [
+    # STORE a x; LOAD b x takes the value from a
+    ('store_load', ['STORE a b', 'LOAD a b', 'PUT b', 'HALT'], ['STORE a b', 'PUT b', 'HALT']),
+    ('store_load', ['STORE a b', 'LOAD c b', 'PUT c', 'HALT'], ['STORE a b', 'RESET c', 'ADD c a', 'PUT c', 'HALT']),
+    ('store_load', ['STORE a b', 'LOAD c d', 'PUT c', 'HALT'], None),
+    # a write nothing reads before the register is overwritten or the program halts
+    ('dead_write', ['INC a', 'RESET a', 'PUT a', 'HALT'], ['RESET a', 'PUT a', 'HALT']),
+    ('dead_write', ['INC a', 'LOAD a b', 'PUT a', 'HALT'], ['LOAD a b', 'PUT a', 'HALT']),
+    ('dead_write', ['INC a', 'ADD b a', 'RESET a', 'PUT b', 'HALT'], ['INC a', 'ADD b a', 'PUT b', 'HALT']),
+    ('dead_write', ['INC a', 'LOAD a a', 'PUT a', 'HALT'], None),
+    ('dead_write', ['INC a', 'label1', 'RESET a', 'PUT a', 'JZERO a label1:B', 'HALT'], None),
+    # a jump to a JUMP goes to its target, unless the jumps go round in a loop
+    ('jump_threading', ['JZERO a label1:F', 'INC a', 'label1', 'JUMP label2:F', 'label3', 'PUT a', 'JUMP label3:B',
+                        'label2', 'HALT'],
+     ['JZERO a label2:F', 'INC a', 'JUMP label2:F', 'label3', 'PUT a', 'JUMP label3:B', 'label2', 'HALT']),
+    ('jump_threading', ['JODD a label1:F', 'PUT a', 'HALT', 'label1', 'JUMP label2:F', 'label2', 'JUMP label3:F',
+                        'label3', 'INC a', 'JUMP label1:B'],
+     ['JODD a label3:F', 'PUT a', 'HALT', 'label3', 'INC a', 'JUMP label3:B']),
+    ('jump_threading', ['JZERO a label1:F', 'PUT a', 'HALT', 'label1', 'JUMP label1:B'], None),
+]
+
+
+@pytest.mark.parametrize('rule, code, expected', PEEPHOLE_REWRITES)
+def test_peephole_rule(rule, code, expected):
+    peephole = PeepholeOptimizer()
+    assert peephole.optimize(code) == (code if expected is None else expected)
+    assert bool(peephole.hits[rule]) == (expected is not None)
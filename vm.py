@@ -0,0 +1,294 @@
+import random
+import sys
+
+GET, PUT, LOAD, STORE, ADD, SUB, RESET, INC, DEC, SHR, SHL, JUMP, JZERO, JODD, HALT = range(15)
+
+OPCODES = {
+    'GET': GET, 'PUT': PUT, 'LOAD': LOAD, 'STORE': STORE, 'ADD': ADD, 'SUB': SUB,
+    'RESET': RESET, 'INC': INC, 'DEC': DEC, 'SHR': SHR, 'SHL': SHL,
+    'JUMP': JUMP, 'JZERO': JZERO, 'JODD': JODD, 'HALT': HALT
+}
+REGISTERS = {r: i for i, r in enumerate('abcdef')}
+
+COST = {
+    GET: 0, PUT: 0, LOAD: 20, STORE: 20, ADD: 5, SUB: 5, RESET: 1, INC: 1, DEC: 1,
+    SHR: 1, SHL: 1, JUMP: 1, JZERO: 1, JODD: 1, HALT: 0
+}
+IO_COST = 100
+
+
+class MachineError(Exception):
+    pass
+
+
+def decode(target_code):
+    program = []
+    for nr, line in enumerate(target_code):
+        s = line.split()
+        if not s or s[0] not in OPCODES:
+            raise MachineError(f'VM: Unknown instruction in line {nr}: {line}')
+        op = OPCODES[s[0]]
+        x = y = 0
+        if op == JUMP:
+            y = int(s[1])
+        elif op in (JZERO, JODD):
+            x = REGISTERS[s[1]]
+            y = int(s[2])
+        elif op in (LOAD, STORE, ADD, SUB):
+            x = REGISTERS[s[1]]
+            y = REGISTERS[s[2]]
+        elif op != HALT:
+            x = REGISTERS[s[1]]
+        program.append((op, x, y))
+    return program
+
+
+class VirtualMachine:
+    # Registers start at 0, or at random values as on the real machine if a seed is given, so that
+    # code reading a register before writing it shows. Running more than max_steps steps is an error.
+    def __init__(self, target_code, inputs=(), max_steps=None, seed=None):
+        self.program = decode(target_code)
+        self.max_steps = max_steps
+        self.inputs = list(inputs)
+        self.outputs = []
+        self.memory = {}
+        if seed is None:
+            self.registers = [0] * 6
+        else:
+            rand = random.Random(seed)
+            self.registers = [rand.randrange(2 ** 31) for _ in range(6)]
+        self.cost = 0
+        self.io_cost = 0
+        self.steps = 0
+
+    def run(self):
+        program = self.program
+        size = len(program)
+        r = self.registers
+        mem = self.memory
+        inputs = iter(self.inputs)
+        outputs = self.outputs
+        t = 0
+        io = 0
+        steps = 0
+        limit = self.max_steps + 1 if self.max_steps else 0
+        lr = 0
+        while True:
+            if lr < 0 or lr >= size:
+                raise MachineError(f'VM: Call to nonexistent instruction {lr}')
+            op, x, y = program[lr]
+            steps += 1
+            if steps == limit:
+                raise MachineError(f'VM: Step limit of {self.max_steps} exceeded')
+            if op == LOAD:
+                r[x] = mem.get(r[y], 0)
+                t += 20
+                lr += 1
+            elif op == STORE:
+                mem[r[y]] = r[x]
+                t += 20
+                lr += 1
+            elif op == JZERO:
+                lr += y if r[x] == 0 else 1
+                t += 1
+            elif op == INC:
+                r[x] += 1
+                t += 1
+                lr += 1
+            elif op == ADD:
+                r[x] += r[y]
+                t += 5
+                lr += 1
+            elif op == SUB:
+                r[x] = r[x] - r[y] if r[x] >= r[y] else 0
+                t += 5
+                lr += 1
+            elif op == JUMP:
+                lr += y
+                t += 1
+            elif op == RESET:
+                r[x] = 0
+                t += 1
+                lr += 1
+            elif op == SHL:
+                r[x] <<= 1
+                t += 1
+                lr += 1
+            elif op == SHR:
+                r[x] >>= 1
+                t += 1
+                lr += 1
+            elif op == JODD:
+                lr += y if r[x] & 1 else 1
+                t += 1
+            elif op == DEC:
+                if r[x] > 0:
+                    r[x] -= 1
+                t += 1
+                lr += 1
+            elif op == GET:
+                try:
+                    mem[r[x]] = next(inputs)
+                except StopIteration:
+                    raise MachineError('VM: Input exhausted') from None
+                io += IO_COST
+                lr += 1
+            elif op == PUT:
+                outputs.append(mem.get(r[x], 0))
+                io += IO_COST
+                lr += 1
+            else:  # HALT
+                break
+        self.cost = t + io
+        self.io_cost = io
+        self.steps = steps
+        return outputs
+
+
+class CompiledMachine(VirtualMachine):
+    # Translates the program into a single Python function. Every jump target starts a trace that
+    # runs straight through conditional jumps (taken branches leave the trace) up to an unconditional
+    # jump, HALT or the size budget. A jump back to the start of its own trace closes it into a loop.
+    # Cost and step counts of every path out of a trace are known statically, so they are added once
+    # per exit instead of once per instruction. The step limit is checked on every trace entry and
+    # on HALT, so a run fails exactly when it takes more than max_steps steps, as on VirtualMachine.
+    TRACE_BUDGET = 200
+
+    def __init__(self, target_code, inputs=(), max_steps=None, seed=None):
+        super().__init__(target_code, inputs, max_steps, seed)
+        self.leaders = {0} | {nr + y for nr, (op, x, y) in enumerate(self.program) if op in (JUMP, JZERO, JODD)}
+        self.source = self.translate()
+        namespace = {'MachineError': MachineError}
+        exec(compile(self.source, '<vm>', 'exec'), namespace)
+        self.execute = namespace['execute']
+
+    def translate(self):
+        lines = ['def execute(mem, registers, next_input, put, limit):',
+                 '    a, b, c, d, e, f = registers',
+                 '    t = io = n = 0',
+                 '    get = mem.get',
+                 '    pc = 0',
+                 '    while True:']
+        self.dispatch(lines, sorted(self.leaders), 2)
+        return '\n'.join(lines) + '\n'
+
+    def dispatch(self, lines, leaders, depth):
+        if len(leaders) == 1:
+            self.trace(lines, leaders[0], depth)
+            return
+        indent = '    ' * depth
+        middle = len(leaders) // 2
+        lines.append(f'{indent}if pc < {leaders[middle]}:')
+        self.dispatch(lines, leaders[:middle], depth + 1)
+        lines.append(f'{indent}else:')
+        self.dispatch(lines, leaders[middle:], depth + 1)
+
+    def trace(self, lines, start, depth):
+        program = self.program
+        body = []  # statements, or (condition, target, cost, io cost, steps) exits
+        t = io = n = 0
+        lr = start
+        while True:
+            if lr in self.leaders and lr != start and n >= self.TRACE_BUDGET or not 0 <= lr < len(program):
+                body.append((None, lr, t, io, n))
+                break
+            op, x, y = program[lr]
+            r = 'abcdef'[x]
+            s = 'abcdef'[y] if op in (LOAD, STORE, ADD, SUB) else None
+            n += 1
+            t += COST[op]
+            if op == LOAD:
+                body.append(f'{r} = get({s}, 0)')
+            elif op == STORE:
+                body.append(f'mem[{s}] = {r}')
+            elif op == ADD:
+                body.append(f'{r} += {s}')
+            elif op == SUB:
+                body.append(f'{r} = {r} - {s} if {r} > {s} else 0')
+            elif op == RESET:
+                body.append(f'{r} = 0')
+            elif op == INC:
+                body.append(f'{r} += 1')
+            elif op == DEC:
+                body.append(f'if {r}: {r} -= 1')
+            elif op == SHR:
+                body.append(f'{r} >>= 1')
+            elif op == SHL:
+                body.append(f'{r} <<= 1')
+            elif op == GET:
+                io += IO_COST
+                body.append(f'mem[{r}] = next_input()')
+            elif op == PUT:
+                io += IO_COST
+                body.append(f'put(get({r}, 0))')
+            elif op == HALT:
+                body.append((None, None, t, io, n))
+                break
+            elif op == JUMP:
+                body.append((None, lr + y, t, io, n))
+                break
+            else:
+                body.append((f'not {r}' if op == JZERO else f'{r} & 1', lr + y, t, io, n))
+            lr += 1
+        indent = '    ' * depth
+        loops = any(isinstance(line, tuple) and line[1] == start for line in body)
+        if loops:
+            lines.append(f'{indent}while True:')
+            indent += '    '
+        if self.max_steps:
+            lines.append(f'{indent}if n > limit: raise MachineError("VM: Step limit of {self.max_steps} exceeded")')
+        for line in body:
+            if isinstance(line, tuple):
+                condition, target, t, io, n = line
+                counts = [f'{name} += {value}' for name, value in (('t', t), ('io', io), ('n', n)) if value]
+                if target is None:
+                    jump = ['return t, io, n']
+                elif not 0 <= target < len(program):
+                    jump = [f'raise MachineError("VM: Call to nonexistent instruction {target}")']
+                elif target == start and loops:
+                    jump = ['continue']
+                else:
+                    jump = [f'pc = {target}', 'break' if loops else 'continue']
+                line = '; '.join(counts + jump)
+                if condition:
+                    line = f'if {condition}: {line}'
+            lines.append(indent + line)
+
+    def run(self):
+        inputs = iter(self.inputs)
+
+        def next_input():
+            try:
+                return next(inputs)
+            except StopIteration:
+                raise MachineError('VM: Input exhausted') from None
+        t, io, self.steps = self.execute(self.memory, self.registers, next_input, self.outputs.append,
+                                         self.max_steps or 0)
+        if self.max_steps and self.steps > self.max_steps:
+            raise MachineError(f'VM: Step limit of {self.max_steps} exceeded')
+        self.cost = t + io
+        self.io_cost = io
+        return self.outputs
+
+
+def run(target_code, inputs=(), compiled=False, seed=None):
+    machine = (CompiledMachine if compiled else VirtualMachine)(target_code, inputs, seed=seed)
+    machine.run()
+    return machine
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 or len(sys.argv) == 3 and sys.argv[2] == '--compiled':
+        engine = CompiledMachine if len(sys.argv) == 3 else VirtualMachine
+        try:
+            with open(sys.argv[1], 'r') as code_file:
+                machine = engine(code_file.read().splitlines(), (int(v) for v in sys.stdin.read().split()),
+                                 seed=random.randrange(2 ** 31))
+            for value in machine.run():
+                print(f'> {value}')
+        except MachineError as e:
+            print(e, file=sys.stderr)
+            exit(1)
+        print(f'Cost: {machine.cost} (i/o: {machine.io_cost})')
+    else:
+        print("Usage: python3 vm.py [code file] [--compiled] < [input]")